@@ -1,9 +1,27 @@
 from __main__ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import os
+import collections
+import logging
 import numpy
-import pickle
+import time
 import json
+from EasyClipLib import bounds
+from EasyClipLib import compaction
+from EasyClipLib import engine
+from EasyClipLib import export
+from EasyClipLib import history
+from EasyClipLib import instrumentation
+from EasyClipLib import landmarks
+from EasyClipLib import planelibrary
+from EasyClipLib import polydata
+from EasyClipLib import preview
+from EasyClipLib import resources
+from EasyClipLib import resultcache
+from EasyClipLib import sceneindex
+from EasyClipLib import transforms
+from EasyClipLib import volumeclip
+from EasyClipLib import worker
 
 #
 # Load Files
@@ -38,14 +56,10 @@ class EasyClip(ScriptedLoadableModule):
 class EasyClipWidget(ScriptedLoadableModuleWidget):
     def setup(self):
         ScriptedLoadableModuleWidget.setup(self)
-        print("-------Easy Clip Widget Setup---------")
+        logging.debug("EasyClip: widget setup")
         # GLOBALS:
         self.logic = EasyClipLogic(self)
-        self.ignoredNodeNames = ('Red Volume Slice', 'Yellow Volume Slice', 'Green Volume Slice')
         self.colorSliceVolumes = dict()
-        self.dictionnaryModel = dict()
-        self.hardenModelIDdict = dict()
-        self.landmarkDescriptionDict = dict()
         self.planeControlsDictionary = {}
         # Instantiate and connect widgets
         #
@@ -138,8 +152,61 @@ class EasyClipWidget(ScriptedLoadableModuleWidget):
                                                                                   self.radio_green_Pos.isChecked()))
         self.ClippingButton = self.logic.get("ClippingButton")
         self.ClippingButton.connect('clicked()', self.ClippingButtonClicked)
+        self.backgroundClippingBox = self.logic.get("backgroundClipping")
+        self.clippingProgress = self.logic.get("clippingProgress")
+        self.clippingProgress.hide()
+        self.CancelClippingButton = self.logic.get("CancelClippingButton")
+        self.CancelClippingButton.connect('clicked()', self.CancelClippingButtonClicked)
+        self.CancelClippingButton.hide()
+        self.backgroundClipping = None
+        self.backgroundClippingTimer = qt.QTimer()
+        self.backgroundClippingTimer.setInterval(100)
+        self.backgroundClippingTimer.connect('timeout()', self.onBackgroundClippingTimer)
+        # Result cache, enabled by the EasyClip/ResultCacheDirectory application setting
+        settings = qt.QSettings()
+        self.logic.setResultCacheDirectory(settings.value("EasyClip/ResultCacheDirectory", ""),
+                                           int(settings.value("EasyClip/ResultCacheMaxBytes", 2 * 1024 ** 3)))
+        # Live preview: the slice nodes are observed while it is on, the timer merges their events
+        self.extraPlanesSelector = self.logic.get("extraPlanesSelector")
+        self.extraPlanesSelector.nodeTypes = ['vtkMRMLMarkupsPlaneNode', 'vtkMRMLMarkupsROINode',
+                                              'vtkMRMLAnnotationROINode']
+        self.extraPlanesSelector.setMRMLScene(slicer.mrmlScene)
+        self.extraPlanesSelector.connect('checkedNodesChanged()', self.onExtraPlanesChanged)
+        self.volumesSelector = self.logic.get("volumesSelector")
+        self.volumesSelector.nodeTypes = ['vtkMRMLScalarVolumeNode', 'vtkMRMLSegmentationNode']
+        self.volumesSelector.setMRMLScene(slicer.mrmlScene)
+        self.cropVolumes = self.logic.get("cropVolumes")
+        self.ClipVolumesButton = self.logic.get("ClipVolumesButton")
+        self.ClipVolumesButton.connect('clicked()', self.ClipVolumesButtonClicked)
+        self.exportFormat = self.logic.get("exportFormat")
+        self.ExportClippedButton = self.logic.get("ExportClippedButton")
+        self.ExportClippedButton.connect('clicked()', self.ExportClippedButtonClicked)
+        self.exportProgress = self.logic.get("exportProgress")
+        self.exportProgress.hide()
+        self.backgroundWriter = None
+        self.exportedFiles = 0
+        self.exportTimer = qt.QTimer()
+        self.exportTimer.setInterval(100)
+        self.exportTimer.connect('timeout()', self.onExportTimer)
+        self.livePreview = self.logic.get("livePreview")
+        self.livePreview.connect('toggled(bool)', self.onLivePreviewToggled)
+        self.sliceObservers = list()
+        self.previewTimer = qt.QTimer()
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(30)
+        self.previewTimer.connect('timeout()', self.logic.updatePreview)
         self.UndoButton = self.logic.get("UndoButton")
         self.UndoButton.connect('clicked()', self.UndoButtonClicked)
+        self.RedoButton = self.logic.get("RedoButton")
+        self.RedoButton.connect('clicked()', self.RedoButtonClicked)
+        self.bandLimitedClipping = self.logic.get("bandLimitedClipping")
+        self.bandLimitedClipping.connect('toggled(bool)', self.onBandLimitedClippingToggled)
+        self.compactClippedModels = self.logic.get("compactClippedModels")
+        self.compactClippedModels.connect('toggled(bool)', self.onCompactClippedModelsToggled)
+        self.splitMode = self.logic.get("splitMode")
+        self.splitMode.connect('toggled(bool)', self.onSplitModeToggled)
+        self.keepLandmarkProjections = self.logic.get("keepLandmarkProjections")
+        self.keepLandmarkProjections.connect('toggled(bool)', self.onKeepLandmarkProjectionsToggled)
         # -------------------------------- PLANES --------------------------------#
         self.CollapsibleButton3 = self.logic.get("CollapsibleButton3")
         self.save = self.logic.get("save")
@@ -151,9 +218,16 @@ class EasyClipWidget(ScriptedLoadableModuleWidget):
 
     def onCloseScene(self, obj, event):
         self.colorSliceVolumes = dict()
+        self.livePreview.setChecked(False)
         for key in self.logic.ColorNodeCorrespondence:
             self.logic.planeDict[self.logic.ColorNodeCorrespondence[key]] = self.logic.planeDef()
-        self.UndoButton.enabled = False
+        self.logic.history.clear()
+        self.logic.boundsCache.clear()
+        self.logic.transformCache.clear()
+        self.logic.proxyCache.clear()
+        self.logic.clippedModelIDs = list()
+        self.logic.temporaryNodes.forget()
+        self.updateUndoRedoButtons()
 
 
     def enter(self):
@@ -168,30 +242,35 @@ class EasyClipWidget(ScriptedLoadableModuleWidget):
                                           planeControls.landmark3ComboBox.currentIndex, planeControls.slider.value, planeControls.slideOpacity.value)
 
         # Checking the names of the fiducials
-        list = slicer.mrmlScene.GetNodesByClass("vtkMRMLMarkupsFiducialNode")
-        end = list.GetNumberOfItems()
-        for i in range(0,end):
-            fidList = list.GetItemAsObject(i)
-            landmarkDescription = self.logic.decodeJSON(fidList.GetAttribute("landmarkDescription"))
-            if landmarkDescription:
-                for n in range(fidList.GetNumberOfMarkups()):
-                    markupID = fidList.GetNthMarkupID(n)
-                    markupLabel = fidList.GetNthMarkupLabel(n)
-                    landmarkDescription[markupID]["landmarkLabel"] = markupLabel
-                fidList.SetAttribute("landmarkDescription",self.logic.encodeJSON(landmarkDescription))
+        for fidList in self.logic.fiducialIndex.getAllLists():
+            self.logic.landmarkCodec.updateLabels(fidList)
         self.onComputeBox()
 
         self.logic.onCheckBoxClicked('Red', self.red_plane_box, self.radio_red_Neg)
         self.logic.onCheckBoxClicked('Green', self.green_plane_box, self.radio_green_Neg)
         self.logic.onCheckBoxClicked('Yellow', self.yellow_plane_box, self.radio_yellow_Neg)
 
+    def cleanup(self):
+        if self.backgroundClipping:
+            self.backgroundClipping.cancel()
+            self.backgroundClipping.wait()
+        if self.backgroundWriter:
+            self.exportTimer.stop()
+            self.backgroundWriter.shutdown()
+        self.logic.cleanup()
+
     def exit(self):
+        self.livePreview.setChecked(False)
         # Remove hidden nodes that are created just for Angle Planes
         for x in self.colorSliceVolumes.values():
             node = slicer.mrmlScene.GetNodeByID(x)
             slicer.mrmlScene.RemoveNode(node)
             node.SetHideFromEditors(False)
         self.colorSliceVolumes = dict()
+        # Remove the preview models and the other temporary nodes
+        logging.info("EasyClip: removing %d temporary nodes holding %.1f MB", len(self.logic.temporaryNodes.keys()),
+                     self.logic.temporaryNodes.nbytes / 1024.0 ** 2)
+        self.logic.temporaryNodes.clear()
         # Hide manual planes
         for planeControls in self.planeControlsDictionary.values():
             if planeControls.PlaneIsDefined():
@@ -219,46 +298,25 @@ class EasyClipWidget(ScriptedLoadableModuleWidget):
         self.logic.readPlaneFunction()
 
     def UndoButtonClicked(self):
-        print("undo:")
-        print(self.dictionnaryModel)
-        self.UndoButton.enabled = False
-        for key,value in self.dictionnaryModel.items():
-            model = slicer.mrmlScene.GetNodeByID(key)
-            model.SetAndObservePolyData(value)
-        for key,value in self.hardenModelIDdict.items():
-            fidList = slicer.mrmlScene.GetNodeByID(key)
-            fidList.SetAttribute("hardenModelID", value)
-        for key,value in self.modelIDdict.items():
-            fidList = slicer.mrmlScene.GetNodeByID(key)
-            fidList.SetAttribute("connectedModelID", value)
-        for key,value in self.landmarkDescriptionDict.items():
-            fidList = slicer.mrmlScene.GetNodeByID(key)
-            fidList.SetAttribute("landmarkDescription",value)
+        self.logic.undo()
+        self.updateUndoRedoButtons()
+
+    def RedoButtonClicked(self):
+        self.logic.redo()
+        self.updateUndoRedoButtons()
+
+    def updateUndoRedoButtons(self):
+        self.UndoButton.enabled = self.logic.history.canUndo()
+        self.RedoButton.enabled = self.logic.history.canRedo()
 
     def onComputeBox(self):
         #--------------------------- Box around the model --------------------------#
-        positionOfVisibleNodes = self.getPositionOfModelNodes(True)
-        if len(positionOfVisibleNodes) == 0:
+        models = self.logic.getVisibleModels()
+        if len(models) == 0:
+            return
+        bound = self.logic.getWorldBoundsOfModels(models)
+        if bound is None:
             return
-        try:
-            maxValue = slicer.sys.float_info.max
-        except:
-            maxValue = self.logic.sys.float_info.max
-        bound = [maxValue, -maxValue, maxValue, -maxValue, maxValue, -maxValue]
-        for i in positionOfVisibleNodes:
-            node = slicer.mrmlScene.GetNthNodeByClass(i, "vtkMRMLModelNode")
-            model = self.logic.createIntermediateHardenModel(node)
-            polydata = model.GetPolyData()
-            if polydata is None or not hasattr(polydata, "GetBounds"):
-                continue
-            tempbound = polydata.GetBounds()
-            bound[0] = min(bound[0], tempbound[0])
-            bound[2] = min(bound[2], tempbound[2])
-            bound[4] = min(bound[4], tempbound[4])
-
-            bound[1] = max(bound[1], tempbound[1])
-            bound[3] = max(bound[3], tempbound[3])
-            bound[5] = max(bound[5], tempbound[5])
         # --------------------------- Box around the model --------------------------#
         dim = []
         origin = []
@@ -287,18 +345,6 @@ class EasyClipWidget(ScriptedLoadableModuleWidget):
             #Reset camera in 3D view to center the models and position the camera so that all actors can be seen
             threeDView.renderWindow().GetRenderers().GetFirstRenderer().ResetCamera()
 
-    def getPositionOfModelNodes(self, onlyVisible):
-        numNodes = slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLModelNode")
-        positionOfNodes = list()
-        for i in range(0, numNodes):
-            node = slicer.mrmlScene.GetNthNodeByClass(i, "vtkMRMLModelNode")
-            if node.GetName() in self.ignoredNodeNames:
-                continue
-            if onlyVisible is True and node.GetDisplayVisibility() == 0:
-                continue
-            positionOfNodes.append(i)
-        return positionOfNodes
-
     def CreateNewNode(self, colorName, color, dim, origin):
         # we add a pseudo-random number to the name of our empty volume to avoid the risk of having a volume called
         #  exactly the same by the user which could be confusing. We could also have used slicer.app.sessionId()
@@ -336,16 +382,126 @@ class EasyClipWidget(ScriptedLoadableModuleWidget):
         return sampleVolumeNode
 
     def ClippingButtonClicked(self):
+        # The full resolution clipping replaces the preview
+        self.livePreview.setChecked(False)
         self.logic.getCoord()
-        self.dictionnaryModel, self.modelIDdict, self.hardenModelIDdict, self.landmarkDescriptionDict\
-            = self.logic.clipping()
-        self.UndoButton.enabled = True
+        # The split mode always runs in the foreground
+        if not self.backgroundClippingBox.isChecked() or self.logic.splitMode:
+            self.logic.clipping()
+            self.updateUndoRedoButtons()
+            return
+        # The clipping runs in a thread, the timer follows its progress and applies the result
+        self.backgroundClipping = self.logic.startBackgroundClipping()
+        self.ClippingButton.enabled = False
+        self.UndoButton.enabled = False
+        self.RedoButton.enabled = False
+        self.clippingProgress.setValue(0)
+        self.clippingProgress.show()
+        self.CancelClippingButton.show()
+        self.backgroundClippingTimer.start()
+
+    def ClipVolumesButtonClicked(self):
+        self.logic.getCoord()
+        self.logic.clipVolumes(self.volumesSelector.checkedNodes(), self.cropVolumes.isChecked())
+
+    def ExportClippedButtonClicked(self):
+        directory = qt.QFileDialog.getExistingDirectory(self.parent, "Export clipped models")
+        if not directory:
+            return
+        self.backgroundWriter = self.logic.exportClippedModels(directory, self.exportFormat.currentText)
+        self.exportedFiles = 0
+        self.ExportClippedButton.enabled = False
+        self.exportProgress.setValue(0)
+        self.exportProgress.show()
+        self.exportTimer.start()
+
+    def onExportTimer(self):
+        # The writer threads only get a new model from here, once the queue has room
+        backgroundWriter = self.backgroundWriter
+        backgroundWriter.dispatch()
+        for result in backgroundWriter.results[self.exportedFiles:]:
+            if result['status'] == export.DONE:
+                logging.info("EasyClip: %s written (%.1f MB in %.2fs, %.1f MB/s)", result['filename'],
+                             result['bytes'] / 1024.0 ** 2, result['seconds'], result['megabytesPerSecond'])
+            else:
+                logging.error("EasyClip: %s not written: %s", result['filename'], result['error'])
+            self.exportedFiles += 1
+        self.exportProgress.setValue(int(100 * backgroundWriter.progress))
+        if backgroundWriter.isRunning():
+            return
+        self.exportTimer.stop()
+        self.backgroundWriter = None
+        backgroundWriter.shutdown()
+        summary = backgroundWriter.summary()
+        logging.info("EasyClip: %d models exported, %d failed", summary['done'], summary['failed'])
+        self.exportProgress.hide()
+        self.ExportClippedButton.enabled = True
+
+    def CancelClippingButtonClicked(self):
+        if self.backgroundClipping:
+            self.backgroundClipping.cancel()
+
+    def onBackgroundClippingTimer(self):
+        backgroundClipping = self.backgroundClipping
+        if backgroundClipping is None:
+            self.backgroundClippingTimer.stop()
+            return
+        self.clippingProgress.setValue(int(100 * backgroundClipping.progress))
+        self.clippingProgress.setFormat("%s %%p%%" % backgroundClipping.currentJobName())
+        if backgroundClipping.isRunning():
+            return
+        self.backgroundClippingTimer.stop()
+        self.backgroundClipping = None
+        try:
+            self.logic.finishBackgroundClipping(backgroundClipping)
+        finally:
+            self.clippingProgress.hide()
+            self.CancelClippingButton.hide()
+            self.ClippingButton.enabled = True
+            self.updateUndoRedoButtons()
+
+    def onBandLimitedClippingToggled(self, checked):
+        self.logic.bandLimitedClipping = checked
+
+    def onSplitModeToggled(self, checked):
+        self.logic.splitMode = checked
+
+    def onCompactClippedModelsToggled(self, checked):
+        self.logic.compaction = dict(compaction.DEFAULT_OPTIONS) if checked else None
+
+    def onKeepLandmarkProjectionsToggled(self, checked):
+        self.logic.keepLandmarkProjections = checked
+
+    def onExtraPlanesChanged(self):
+        self.logic.setExtraPlaneNodes(self.extraPlanesSelector.checkedNodes())
+        if self.livePreview.isChecked():
+            self.previewTimer.start()
+
+    def onLivePreviewToggled(self, checked):
+        for node, tag in self.sliceObservers:
+            node.RemoveObserver(tag)
+        self.sliceObservers = list()
+        self.previewTimer.stop()
+        if not checked:
+            self.logic.stopPreview()
+            return
+        for sliceNodeID in self.logic.ColorNodeCorrespondence.values():
+            sliceNode = slicer.mrmlScene.GetNodeByID(sliceNodeID)
+            tag = sliceNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onSliceModified)
+            self.sliceObservers.append((sliceNode, tag))
+        self.logic.startPreview()
+
+    def onSliceModified(self, caller, event):
+        if not self.previewTimer.isActive():
+            self.previewTimer.start()
 
     def updateSliceState(self, plane, boxState, negState, posState):
-        print("Update Slice State")
+        logging.debug("EasyClip: update slice state of %s", plane)
         self.logic.planeDict[plane].boxState = boxState
         self.logic.planeDict[plane].negState = negState
         self.logic.planeDict[plane].posState = posState
+        if self.livePreview.isChecked():
+            self.previewTimer.start()
 
 
 
@@ -368,8 +524,6 @@ class EasyClipLogic(ScriptedLoadableModuleLogic):
             self.boxState = False
             self.negState = False
             self.posState = False
-            # Plane for cliping
-            self.vtkPlane = vtk.vtkPlane()
 
     def __init__(self, interface):
         self.interface = interface
@@ -381,6 +535,47 @@ class EasyClipLogic(ScriptedLoadableModuleLogic):
         self.planeDict = dict()
         for key in self.ColorNodeCorrespondence:
             self.planeDict[self.ColorNodeCorrespondence[key]] = self.planeDef()
+        # Only run vtkClipClosedSurface on the cells close to the planes
+        self.bandLimitedClipping = False
+        # Models clipped in parallel, each with its own planes and clipper
+        self.clippingThreads = min(8, os.cpu_count() or 1)
+        # Clipped meshes kept on disk (see setResultCacheDirectory), None to always clip
+        self.resultCache = None
+        # Keep the removed part of each clipped model as a new model
+        self.splitMode = False
+        # Keyword arguments of compaction.compactPolyData applied to the clipped models, None to keep them as clipped
+        self.compaction = None
+        # Models clipped (or created by the split mode) since the scene was opened, for the export
+        self.clippedModelIDs = list()
+        # Stage timings of the last clipping runs (profiler.lastRun().summary(), profiler.export(filename))
+        self.profiler = instrumentation.ClipProfiler()
+        # Planes used in addition to the slice planes: name -> list of world planes,
+        # or node ID -> None for the markups planes and ROIs read at each clipping
+        self.extraPlanes = collections.OrderedDict()
+        # Decimated models clipped by the live preview, and the models they replace
+        self.proxyCache = preview.ProxyCache(targetTriangles=20000)
+        self.previewModelIDs = list()
+        # Undo/redo of the clips, stored compressed under a memory budget (in bytes)
+        self.history = history.ClipHistory(byteBudget=512 * 1024 * 1024)
+        # World bounds of the models, memoized on their polydata and transform MTimes
+        self.boundsCache = bounds.BoundsCache()
+        # World to local matrices of the parent transforms of the models
+        self.transformCache = transforms.TransformCache()
+        # Hidden helper nodes, reused between operations and removed when leaving the module
+        self.temporaryNodes = resources.TemporaryNodePool(slicer.mrmlScene)
+        # Fiducial lists connected to each model
+        self.fiducialIndex = sceneindex.FiducialListIndex(slicer.mrmlScene)
+        # Model nodes with their visibility and transform
+        self.modelRegistry = sceneindex.ModelRegistry(slicer.mrmlScene)
+        # Cached parser of the landmarkDescription attributes
+        self.landmarkCodec = landmarks.LandmarkDescriptionCodec()
+        # Remap the projected landmarks onto the clipped models instead of unprojecting them
+        self.keepLandmarkProjections = False
+
+    def cleanup(self):
+        # Removes the scene observers added by the logic
+        self.fiducialIndex.stop()
+        self.modelRegistry.stop()
 
     def get(self, objectName):
         return self.findWidget(self.interface.widget, objectName)
@@ -395,27 +590,8 @@ class EasyClipLogic(ScriptedLoadableModuleLogic):
                     return resulting_widget
             return None
 
-    def createIntermediateHardenModel(self, model):
-        hardenModel = slicer.mrmlScene.GetNodesByName("SurfaceRegistration_" + model.GetName() + "_hardenCopy_" + str(
-            slicer.app.applicationPid())).GetItemAsObject(0)
-        if hardenModel is None:
-            hardenModel = slicer.vtkMRMLModelNode()
-        hardenPolyData = vtk.vtkPolyData()
-        hardenPolyData.DeepCopy(model.GetPolyData())
-        hardenModel.SetAndObservePolyData(hardenPolyData)
-        hardenModel.SetName(
-            "SurfaceRegistration_" + model.GetName() + "_hardenCopy_" + str(slicer.app.applicationPid()))
-        if model.GetParentTransformNode():
-            hardenModel.SetAndObserveTransformNodeID(model.GetParentTransformNode().GetID())
-        hardenModel.HideFromEditorsOn()
-        slicer.mrmlScene.AddNode(hardenModel)
-        logic = slicer.vtkSlicerTransformLogic()
-        logic.hardenTransform(hardenModel)
-        return hardenModel
-
     def onCheckBoxClicked(self, colorPlane, checkBox, radioButton ):
         slice = slicer.util.getNode(self.ColorNodeCorrespondence[colorPlane])
-        print("Slice test", slice)
         if checkBox.isChecked():
             slice.SetWidgetVisible(True)
             radioButton.setChecked(True)
@@ -446,61 +622,416 @@ class EasyClipLogic(ScriptedLoadableModuleLogic):
 
 
     def clipping(self):
-        planeCollection = vtk.vtkPlaneCollection()
-        harden = slicer.vtkSlicerTransformLogic()
-        tempTransform = slicer.vtkMRMLLinearTransformNode()
-        tempTransform.HideFromEditorsOn()
-        slicer.mrmlScene.AddNode(tempTransform)
-        numNodes = slicer.mrmlScene.GetNumberOfNodesByClass("vtkMRMLModelNode")
-        dictionnaryModel = dict()
-        hardenModelIDdict = dict()
-        landmarkDescriptionDict = dict()
-        modelIDdict = dict()
-        for i in range(3, numNodes):
-            planeCollection.RemoveAllItems()
-            mh = slicer.mrmlScene.GetNthNodeByClass(i, "vtkMRMLModelNode")
-            if mh.GetDisplayVisibility() == 0:
+        run = self.profiler.startRun("split" if self.splitMode else "clipping")
+        jobs = self.prepareClipping(run=run)
+        if self.splitMode:
+            engine.splitJobs(jobs, maxWorkers=self.clippingThreads)
+        else:
+            engine.clipJobs(jobs, self.clippingOptions(), maxWorkers=self.clippingThreads, cache=self.resultCache,
+                            compaction=self.compaction)
+        step = self.applyClipping(jobs, run)
+        self.profiler.finishRun(run)
+        return step
+
+    def clippingOptions(self):
+        # Keyword arguments of engine.clipPolyData
+        return {'bandLimited': self.bandLimitedClipping}
+
+    def setResultCacheDirectory(self, directory, maxBytes=2 * 1024 ** 3):
+        # An empty directory disables the cache
+        if not directory:
+            self.resultCache = None
+            return
+        self.resultCache = resultcache.ClipResultCache(directory, maxBytes)
+
+    def getWorldPlanes(self):
+        # Checked slice planes, then the extra planes
+        planes = list()
+        for key, planeDef in self.planeDict.items():
+            if planeDef.boxState:
+                origin = numpy.asarray(planeDef.P).ravel()[:3].tolist()
+                normal = numpy.asarray(planeDef.n).ravel()[:3].tolist()
+                if planeDef.negState:
+                    normal = [-normal[0], -normal[1], -normal[2]]
+                planes.append((origin, normal))
+        for name, extraPlanes in self.extraPlanes.items():
+            if extraPlanes is None:
+                node = slicer.mrmlScene.GetNodeByID(name)
+                if node is not None:
+                    planes.extend(self.getNodePlanes(node))
+            else:
+                planes.extend(extraPlanes)
+        return planes
+
+    def getNodePlanes(self, node):
+        # World planes of a markups plane (keeping the side of its normal) or of a ROI (keeping its inside)
+        if node.IsA("vtkMRMLMarkupsPlaneNode"):
+            origin = [0.0, 0.0, 0.0]
+            normal = [0.0, 0.0, 0.0]
+            node.GetOriginWorld(origin)
+            node.GetNormalWorld(normal)
+            return [(origin, normal)]
+        if node.IsA("vtkMRMLMarkupsROINode"):
+            center = [0.0, 0.0, 0.0]
+            node.GetCenterWorld(center)
+            matrix = node.GetObjectToWorldMatrix()
+            axes = list()
+            radii = list()
+            for column in range(3):
+                axis = [matrix.GetElement(row, column) for row in range(3)]
+                norm = numpy.linalg.norm(axis)
+                axes.append([x / norm for x in axis])
+                radii.append(node.GetSize()[column] / 2.0 * norm)
+            return engine.orientedBoxPlanes(center, axes, radii)
+        if node.IsA("vtkMRMLAnnotationROINode"):
+            center = [0.0, 0.0, 0.0]
+            radius = [0.0, 0.0, 0.0]
+            node.GetXYZ(center)
+            node.GetRadiusXYZ(radius)
+            return engine.orientedBoxPlanes(center, ((1, 0, 0), (0, 1, 0), (0, 0, 1)), radius)
+        return []
+
+    def addExtraPlanes(self, name, planes):
+        # planes: list of (origin, normal) in world coordinates, normals pointing to the kept side
+        self.extraPlanes[name] = list(planes)
+
+    def addCuttingBox(self, name, bounds):
+        self.addExtraPlanes(name, engine.boxPlanes(bounds))
+
+    def addPresetPlanes(self, preset, sides=None):
+        self.addExtraPlanes(preset.name, preset.planes(sides))
+
+    def addExtraPlaneNode(self, node):
+        # Markups plane or ROI, read at each clipping
+        self.extraPlanes[node.GetID()] = None
+
+    def setExtraPlaneNodes(self, nodes):
+        for name in [name for name, planes in self.extraPlanes.items() if planes is None]:
+            del self.extraPlanes[name]
+        for node in nodes:
+            self.addExtraPlaneNode(node)
+
+    def removeExtraPlanes(self, name):
+        self.extraPlanes.pop(name, None)
+
+    def clearExtraPlanes(self):
+        self.extraPlanes.clear()
+
+    def getWorldBoundsOfModels(self, models):
+        # World bounds are computed from the points, without hardening a copy of each model
+        modelBounds = list()
+        for model in models:
+            tempbound = self.boundsCache.getWorldBounds(model)
+            if tempbound is not None:
+                modelBounds.append(tempbound)
+        return bounds.unionBounds(modelBounds)
+
+    def getVisibleModels(self):
+        # Visible models that are not slice models, temporary nodes or marked with the EasyClip.Ignore attribute
+        return self.modelRegistry.getVisibleModels()
+
+    def prepareClipping(self, models=None, run=None):
+        # Main thread: one job per model (the visible ones by default), with the planes in the coordinates of the model
+        if models is None:
+            models = self.getVisibleModels()
+        # All the planes are applied in one pass, with one capping
+        worldPlanes = self.getWorldPlanes()
+        jobs = list()
+        for model in models:
+            polyData = model.GetPolyData()
+            if polyData is None:
                 continue
-            model = slicer.util.getNode(mh.GetName())
+            start = time.perf_counter()
+            # Computes and caches the bounds here, not in the clipping thread
+            polyData.GetBounds()
             transform = model.GetParentTransformNode()
-            if transform:
-                tempTransform.Copy(transform)
-                harden.hardenTransform(tempTransform)
-                m = vtk.vtkMatrix4x4()
-                tempTransform.GetMatrixTransformToParent(m)
-                m.Invert(m, m)
+            if transform is None:
+                jobs.append(engine.ClipJob(model.GetID(), polyData, worldPlanes, model.GetName()))
+            elif self.transformCache.isLinear(transform):
+                planes = transforms.transformPlanes(worldPlanes, *self.transformCache.getMatrices(transform))
+                jobs.append(engine.ClipJob(model.GetID(), polyData, planes, model.GetName()))
             else:
-                m = vtk.vtkMatrix4x4()
-            for key, planeDef in self.planeDict.items():
-                hardenP = m.MultiplyPoint(planeDef.P)
-                hardenN = m.MultiplyPoint(planeDef.n)
-                if planeDef.boxState:
-                    planeDef.vtkPlane.SetOrigin(hardenP[0], hardenP[1], hardenP[2])
-                    if planeDef.negState:
-                        planeDef.vtkPlane.SetNormal(-hardenN[0], -hardenN[1], -hardenN[2])
-                    if planeDef.posState:
-                        planeDef.vtkPlane.SetNormal(hardenN[0], hardenN[1], hardenN[2])
-                    planeCollection.AddItem(planeDef.vtkPlane)
-            dictionnaryModel[model.GetID()]= model.GetPolyData()
-            polyData = model.GetPolyData()
-            clipper = vtk.vtkClipClosedSurface()
-            clipper.SetClippingPlanes(planeCollection)
-            clipper.SetInputData(polyData)
-            clipper.SetGenerateFaces(1)
-            clipper.SetScalarModeToLabels()
-            clipper.Update()
-            polyDataNew = clipper.GetOutput()
-            model.SetAndObservePolyData(polyDataNew)
-            # Checking if one ore more fiducial list are connected to this model
-            list = slicer.mrmlScene.GetNodesByClass("vtkMRMLMarkupsFiducialNode")
-            end = list.GetNumberOfItems()
-            for i in range(0,end):
-                fidList = list.GetItemAsObject(i)
-                if fidList.GetAttribute("connectedModelID"):
-                    if fidList.GetAttribute("connectedModelID") == model.GetID():
-                        modelIDdict[fidList.GetID()], hardenModelIDdict[fidList.GetID()], landmarkDescriptionDict[fidList.GetID()] = \
-                            self.unprojectLandmarks(fidList)
-        return dictionnaryModel, modelIDdict, hardenModelIDdict, landmarkDescriptionDict
+                toWorld, fromWorld = self.transformCache.getGeneralTransforms(transform)
+                jobs.append(engine.ClipJob(model.GetID(), polyData, worldPlanes, model.GetName(),
+                                           toWorld, fromWorld))
+            if run is not None:
+                run.model(model.GetID(), model.GetName())
+                run.record("prepare", time.perf_counter() - start, model.GetID())
+                run.count(model.GetID(), trianglesIn=polyData.GetNumberOfPolys(),
+                          bytesIn=instrumentation.polyDataBytes(polyData))
+        return jobs
+
+    def applyClipping(self, jobs, run=None):
+        # Main thread: results of the jobs set on the models, in one undo step.
+        # run: instrumentation.ClipRun recording the stages, or None
+        if run is None:
+            run = instrumentation.ClipRun("apply")
+        step = history.ClipStep()
+        for job in jobs:
+            polyData = job.polyData
+            polyDataNew = job.result
+            if job.seconds is not None:
+                run.record("clip", job.seconds, job.key)
+            if polyDataNew is None or polyDataNew is polyData:
+                # The model is entirely on the kept side of every plane
+                if polyDataNew is not None:
+                    run.count(job.key, trianglesOut=polyData.GetNumberOfPolys(),
+                              bytesOut=instrumentation.polyDataBytes(polyData))
+                continue
+            run.count(job.key, trianglesOut=polyDataNew.GetNumberOfPolys(),
+                      bytesOut=instrumentation.polyDataBytes(polyDataNew))
+            if job.bytesBeforeCompaction is not None:
+                run.count(job.key, bytesSaved=job.bytesBeforeCompaction - job.bytesAfterCompaction)
+                logging.info("EasyClip: %s compacted from %.1f to %.1f MB", job.name,
+                             job.bytesBeforeCompaction / 1024.0 ** 2, job.bytesAfterCompaction / 1024.0 ** 2)
+            model = slicer.mrmlScene.GetNodeByID(job.key)
+            with run.stage("snapshot", job.key):
+                step.models[model.GetID()] = self.history.snapshot(polyData)
+            run.count(job.key, snapshotBytes=step.models[model.GetID()].nbytes)
+            with run.stage("setPolyData", job.key):
+                model.SetAndObservePolyData(polyDataNew)
+                if job.removed is not None and job.removed.GetNumberOfCells():
+                    color = model.GetDisplayNode().GetColor() if model.GetDisplayNode() else None
+                    removedModel = self.addModel(model.GetName() + "_removed", job.removed,
+                                                 model.GetTransformNodeID(), color)
+                    step.createdModelIDs.append(removedModel.GetID())
+            # Fiducial lists connected to this model
+            with run.stage("landmarks", job.key):
+                locator = None
+                for fidList in self.fiducialIndex.getConnectedLists(model.GetID()):
+                    step.attributes[fidList.GetID()] = self.captureLandmarkAttributes(fidList)
+                    # Nothing to remap the landmarks onto when the whole model is removed
+                    if self.keepLandmarkProjections and polyDataNew.GetNumberOfPoints():
+                        if locator is None:
+                            # One locator per clipped model, shared by all its fiducial lists
+                            locator = polydata.buildPointLocator(polyDataNew)
+                        self.remapLandmarks(fidList, model, polyData, polyDataNew, locator, step)
+                    else:
+                        self.unprojectLandmarks(fidList)
+        if step.models:
+            with run.stage("history"):
+                self.history.push(step)
+            for modelID in list(step.models) + step.createdModelIDs:
+                if modelID not in self.clippedModelIDs:
+                    self.clippedModelIDs.append(modelID)
+            if self.profiler.measureRendering:
+                with run.stage("render"):
+                    slicer.util.forceRenderAllViews()
+        return step
+
+    def clipVolumes(self, nodes, crop=False):
+        # Label maps, scalar volumes and segmentations clipped with the same planes as the models
+        worldPlanes = self.getWorldPlanes()
+        if not worldPlanes:
+            return
+        for node in nodes:
+            if node.IsA("vtkMRMLSegmentationNode"):
+                self.clipSegmentation(node, worldPlanes, crop)
+            else:
+                self.clipVolume(node, worldPlanes, crop)
+
+    def clipVolume(self, volumeNode, worldPlanes, crop=False):
+        # The removed voxels get the background value: 0 for a label map, the minimum of a scalar volume
+        array = slicer.util.arrayFromVolume(volumeNode)
+        if array is None or array.size == 0:
+            return
+        background = 0 if volumeNode.IsA("vtkMRMLLabelMapVolumeNode") else array.min()
+        ijkToRAS = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRAS)
+        ijkToRAS = transforms.matrixAsArray(ijkToRAS)
+        transform = volumeNode.GetParentTransformNode()
+        toWorld = None
+        if transform is None:
+            planes = worldPlanes
+        elif self.transformCache.isLinear(transform):
+            planes = transforms.transformPlanes(worldPlanes, *self.transformCache.getMatrices(transform))
+        else:
+            planes = worldPlanes
+            toWorld = self.transformCache.getGeneralTransforms(transform)[0]
+        extent = volumeclip.clipVolumeArray(array, ijkToRAS, planes, background, toWorld)
+        if crop and extent is not None:
+            cropped, firstIJK = volumeclip.cropArray(array, extent)
+            # The cropped grid starts at the first kept voxel, with the same spacing and directions
+            volumeNode.SetOrigin(numpy.dot(ijkToRAS, list(firstIJK) + [1.0])[:3].tolist())
+            slicer.util.updateVolumeFromArray(volumeNode, cropped)
+        else:
+            slicer.util.arrayFromVolumeModified(volumeNode)
+
+    def clipSegmentation(self, segmentationNode, worldPlanes, crop=False):
+        # The segments go through a temporary label map, then replace the original segments
+        segmentationsLogic = slicer.modules.segmentations.logic()
+        segmentIDs = vtk.vtkStringArray()
+        segmentationNode.GetSegmentation().GetSegmentIDs(segmentIDs)
+        if segmentIDs.GetNumberOfValues() == 0:
+            return
+        labelmap = self.temporaryNodes.acquire("vtkMRMLLabelMapVolumeNode", "segmentationLabelmap")
+        try:
+            segmentationsLogic.ExportSegmentsToLabelmapNode(segmentationNode, segmentIDs, labelmap)
+            labelmap.SetAndObserveTransformNodeID(segmentationNode.GetTransformNodeID())
+            self.clipVolume(labelmap, worldPlanes, crop)
+            segmentationsLogic.ImportLabelmapToSegmentationNode(labelmap, segmentationNode, segmentIDs)
+        finally:
+            self.temporaryNodes.remove("segmentationLabelmap")
+
+    def startPreview(self):
+        # The visible models are hidden and replaced by their clipped proxies until stopPreview
+        self.stopPreview()
+        for model in self.getVisibleModels():
+            self.previewModelIDs.append(model.GetID())
+            model.SetDisplayVisibility(0)
+        self.updatePreview()
+
+    def updatePreview(self):
+        models = [slicer.mrmlScene.GetNodeByID(modelID) for modelID in self.previewModelIDs]
+        models = [model for model in models if model is not None]
+        if not models:
+            return
+        self.getCoord()
+        jobs = self.prepareClipping(models)
+        for job in jobs:
+            job.polyData = self.proxyCache.getProxy(job.key, job.polyData)
+        engine.clipJobs(jobs, maxWorkers=self.clippingThreads)
+        for job in jobs:
+            model = slicer.mrmlScene.GetNodeByID(job.key)
+            previewModel = self.temporaryNodes.acquire("vtkMRMLModelNode", "preview_" + job.key)
+            if previewModel.GetDisplayNode() is None:
+                previewModel.SetName("EasyClip_Preview_" + model.GetName())
+                previewModel.CreateDefaultDisplayNodes()
+                if model.GetDisplayNode():
+                    previewModel.GetDisplayNode().SetColor(model.GetDisplayNode().GetColor())
+            previewModel.SetAndObserveTransformNodeID(model.GetTransformNodeID())
+            previewModel.SetAndObservePolyData(job.result)
+
+    def stopPreview(self):
+        for modelID in self.previewModelIDs:
+            self.temporaryNodes.remove("preview_" + modelID)
+            model = slicer.mrmlScene.GetNodeByID(modelID)
+            if model is not None:
+                model.SetDisplayVisibility(1)
+        self.previewModelIDs = list()
+
+    def jobsAreCurrent(self, jobs):
+        # False if a model was removed or got a new polydata while its job was computed
+        for job in jobs:
+            model = slicer.mrmlScene.GetNodeByID(job.key)
+            if model is None or model.GetPolyData() is not job.polyData:
+                return False
+        return True
+
+    def startBackgroundClipping(self):
+        run = self.profiler.startRun("background clipping")
+        backgroundClipping = worker.BackgroundClipping(self.prepareClipping(run=run), self.clippingOptions(),
+                                                       self.clippingThreads, self.resultCache, self.compaction,
+                                                       clipRun=run)
+        backgroundClipping.start()
+        return backgroundClipping
+
+    def finishBackgroundClipping(self, backgroundClipping):
+        # All the results are applied together, or none of them
+        if backgroundClipping.error is not None:
+            raise backgroundClipping.error
+        if not backgroundClipping.completed or backgroundClipping.isCancelled():
+            return None
+        if not self.jobsAreCurrent(backgroundClipping.jobs):
+            logging.warning("EasyClip: the models changed during the clipping, the result is discarded")
+            return None
+        step = self.applyClipping(backgroundClipping.jobs, backgroundClipping.clipRun)
+        self.profiler.finishRun(backgroundClipping.clipRun)
+        return step
+
+    def exportClippedModels(self, directory, extension='.vtp', maxWorkers=2, maxQueueBytes=512 * 1024 * 1024):
+        # The clipped models still in the scene are written in background threads, one file per model
+        # named after it. Returns the export.BackgroundWriter, dispatch() must be called until it is done
+        if extension not in export.EXPORT_FORMATS:
+            raise ValueError("Unsupported export format: %s" % extension)
+        backgroundWriter = export.BackgroundWriter(maxWorkers, maxQueueBytes)
+        filenames = set()
+        for modelID in self.clippedModelIDs:
+            model = slicer.mrmlScene.GetNodeByID(modelID)
+            if model is None or model.GetPolyData() is None:
+                continue
+            name = "".join(c if c.isalnum() or c in "-_." else "_" for c in model.GetName())
+            filename = os.path.join(directory, name + extension)
+            index = 1
+            while filename in filenames:
+                index += 1
+                filename = os.path.join(directory, "%s_%d%s" % (name, index, extension))
+            filenames.add(filename)
+            backgroundWriter.submit(model.GetName(), model.GetPolyData(), filename)
+        backgroundWriter.dispatch()
+        return backgroundWriter
+
+    def captureLandmarkAttributes(self, fidList):
+        attributes = dict()
+        for name in ("connectedModelID", "hardenModelID", "landmarkDescription"):
+            attributes[name] = fidList.GetAttribute(name)
+        return attributes
+
+    def captureStep(self, step):
+        # Current state of the nodes modified by step
+        currentStep = history.ClipStep()
+        for modelID in step.models:
+            model = slicer.mrmlScene.GetNodeByID(modelID)
+            if model and model.GetPolyData():
+                currentStep.models[modelID] = self.history.snapshot(model.GetPolyData())
+        for nodeID, attributes in step.attributes.items():
+            node = slicer.mrmlScene.GetNodeByID(nodeID)
+            if node:
+                currentStep.attributes[nodeID] = dict((name, node.GetAttribute(name)) for name in attributes)
+        for modelID in step.createdModelIDs:
+            model = slicer.mrmlScene.GetNodeByID(modelID)
+            if model and model.GetPolyData():
+                color = model.GetDisplayNode().GetColor() if model.GetDisplayNode() else None
+                currentStep.removedModels.append(history.ModelRecord(
+                    model.GetName(), self.history.snapshot(model.GetPolyData()), model.GetTransformNodeID(), color))
+        return currentStep
+
+    def restoreStep(self, step, inverseStep=None):
+        # inverseStep: step captured before the restore, completed with the IDs of the models added back
+        for modelID in step.createdModelIDs:
+            model = slicer.mrmlScene.GetNodeByID(modelID)
+            if model:
+                if model.GetDisplayNode():
+                    slicer.mrmlScene.RemoveNode(model.GetDisplayNode())
+                slicer.mrmlScene.RemoveNode(model)
+        for record in step.removedModels:
+            model = self.addModel(record.name, record.snapshot.restore(), record.transformNodeID, record.color)
+            if inverseStep is not None:
+                inverseStep.createdModelIDs.append(model.GetID())
+        for modelID, snapshot in step.models.items():
+            model = slicer.mrmlScene.GetNodeByID(modelID)
+            if model:
+                model.SetAndObservePolyData(snapshot.restore())
+        for nodeID, attributes in step.attributes.items():
+            node = slicer.mrmlScene.GetNodeByID(nodeID)
+            if node:
+                for name, value in attributes.items():
+                    node.SetAttribute(name, value)
+
+    def undo(self):
+        step = self.history.popUndo()
+        if step is None:
+            return
+        redoStep = self.captureStep(step)
+        self.restoreStep(step, redoStep)
+        self.history.pushRedo(redoStep)
+
+    def redo(self):
+        step = self.history.popRedo()
+        if step is None:
+            return
+        undoStep = self.captureStep(step)
+        self.restoreStep(step, undoStep)
+        self.history.pushUndo(undoStep)
+
+    def addModel(self, name, polyData, transformNodeID=None, color=None):
+        model = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", slicer.mrmlScene.GenerateUniqueName(name))
+        model.SetAndObservePolyData(polyData)
+        model.CreateDefaultDisplayNodes()
+        if color is not None:
+            model.GetDisplayNode().SetColor(color)
+        model.SetAndObserveTransformNodeID(transformNodeID)
+        return model
 
     def unprojectLandmarks(self, fidList):
         hardenModelID = fidList.GetAttribute("hardenModelID")
@@ -508,66 +1039,129 @@ class EasyClipLogic(ScriptedLoadableModuleLogic):
         landmarkDescriptioncopy = fidList.GetAttribute("landmarkDescription")
         fidList.SetAttribute("connectedModelID", None)
         fidList.SetAttribute("hardenModelID", None)
-        landmarkDescription = self.decodeJSON(fidList.GetAttribute("landmarkDescription"))
-        for n in range(fidList.GetNumberOfMarkups()):
-            markupID = fidList.GetNthMarkupID(n)
-            landmarkDescription[markupID]["projection"]["isProjected"] = False
-            landmarkDescription[markupID]["projection"]["closestPointIndex"] = None
-            landmarkDescription[markupID]["ROIradius"] = 0
-        fidList.SetAttribute("landmarkDescription",self.encodeJSON(landmarkDescription))
+        self.landmarkCodec.clearProjections(fidList)
         return ModelID, hardenModelID, landmarkDescriptioncopy
 
 
-    def saveFunction(self):
-        filename = qt.QFileDialog.getSaveFileName(self.interface.parent, "Save file")
-        tempDictionary = {}
+    def remapLandmarks(self, fidList, model, polyData, polyDataNew, locator, step=None):
+        # step: history.ClipStep recording the hardened copy before it is replaced, so that undo restores it
+        oldPoints = polydata.pointsAsArray(polyData) if polyData.GetNumberOfPoints() else []
+        self.landmarkCodec.remapProjections(fidList, oldPoints, polyDataNew, locator)
+        # The landmarks are projected on the hardened copy of the model: it has to follow the clipping
+        hardenModel = slicer.mrmlScene.GetNodeByID(fidList.GetAttribute("hardenModelID") or "")
+        if hardenModel is None:
+            return
+        if step is not None and hardenModel.GetID() not in step.models and hardenModel.GetPolyData() is not None:
+            step.models[hardenModel.GetID()] = self.history.snapshot(hardenModel.GetPolyData())
+        hardenPolyData = vtk.vtkPolyData()
+        transformNode = model.GetParentTransformNode()
+        if transformNode:
+            transform = vtk.vtkGeneralTransform()
+            transformNode.GetTransformToWorld(transform)
+            transformFilter = vtk.vtkTransformPolyDataFilter()
+            transformFilter.SetTransform(transform)
+            transformFilter.SetInputData(polyDataNew)
+            transformFilter.Update()
+            hardenPolyData.DeepCopy(transformFilter.GetOutput())
+        else:
+            hardenPolyData.DeepCopy(polyDataNew)
+        hardenModel.SetAndObservePolyData(hardenPolyData)
+
+    def currentPreset(self, name, metadata=None):
+        # Plane preset of the current slice positions and of the planes checked for clipping
+        matrices = dict()
         for key in self.ColorNodeCorrespondence:
             slice = slicer.util.getNode(self.ColorNodeCorrespondence[key])
-            tempDictionary[key] = self.getMatrix(slice).tolist()
-        if filename is None:
-            filename = qt.QFileDialog.getSaveFileName(self.interface.parent, "Save file")
-        if filename != "":
-            fileObj = open(filename, "wb")
-            pickle.dump(tempDictionary, fileObj)
-            fileObj.close()
+            matrices[key] = self.getMatrix(slice).tolist()
+        sides = dict()
+        for key, sliceNodeID in self.ColorNodeCorrespondence.items():
+            planeDef = self.planeDict[sliceNodeID]
+            if planeDef.boxState:
+                sides[key] = 'neg' if planeDef.negState else 'pos'
+        return planelibrary.PlanePreset(name, matrices, sides, metadata)
+
+    def savePreset(self, filename, name, metadata=None):
+        # Adds (or replaces) the preset in the library file, created if needed
+        if os.path.exists(filename):
+            library = planelibrary.PlaneLibrary.load(filename)
+        else:
+            library = planelibrary.PlaneLibrary()
+        library.addPreset(self.currentPreset(name, metadata))
+        library.save(filename)
+
+    def applyPreset(self, preset):
+        for key in self.ColorNodeCorrespondence:
+            node = slicer.mrmlScene.GetNodeByID(self.ColorNodeCorrespondence[key])
+            matList = preset.matrices[key]
+            matNode = node.GetSliceToRAS()
+            for col in range(0, len(matList)):
+                for row in range(0, len(matList[col])):
+                    matNode.SetElement(col, row, matList[col][row])
+            node.UpdateMatrices()
+        # Planes checked for clipping and kept sides
+        for key, sliceNodeID in self.ColorNodeCorrespondence.items():
+            side = preset.sides.get(key)
+            planeDef = self.planeDict[sliceNodeID]
+            planeDef.boxState = side is not None
+            planeDef.negState = side == 'neg'
+            planeDef.posState = side == 'pos'
+            if self.interface is not None:
+                color = key.lower()
+                checkBox = getattr(self.interface, color + '_plane_box')
+                radioNeg = getattr(self.interface, 'radio_' + color + '_Neg')
+                radioPos = getattr(self.interface, 'radio_' + color + '_Pos')
+                checkBox.setChecked(planeDef.boxState)
+                self.onCheckBoxClicked(key, checkBox, radioNeg)
+                if side == 'pos':
+                    radioPos.setChecked(True)
+
+    def loadPreset(self, filename, name=None):
+        # No dialog: the preset called name, or the first one of the library
+        library = planelibrary.PlaneLibrary.load(filename)
+        if name is None:
+            name = library.names()[0]
+        preset = library.getPreset(name)
+        self.applyPreset(preset)
+        return preset
+
+    def saveFunction(self):
+        filename = qt.QFileDialog.getSaveFileName(self.interface.parent, "Save file", "",
+                                                  "EasyClip plane library (*.json *.json.gz)")
+        if filename:
+            name = os.path.basename(filename).split('.')[0]
+            # PythonQt only returns the text, empty if the dialog is cancelled
+            name = qt.QInputDialog.getText(self.interface.parent, "Save planes", "Preset name:",
+                                           qt.QLineEdit.Normal, name)
+            if name:
+                self.savePreset(filename, name)
 
     def readPlaneFunction(self):
         filename = qt.QFileDialog.getOpenFileName(self.interface.parent, "Open file")
-        if filename is None:
-            filename = qt.QFileDialog.getOpenFileName(self.interface.parent, "Open file")
-        if filename != "":
-            fileObj = open(filename, "rb")
-            tempDictionary = pickle.load(fileObj)
-            for key in self.ColorNodeCorrespondence:
-                node = slicer.mrmlScene.GetNodeByID(self.ColorNodeCorrespondence[key])
-                matList = tempDictionary[key]
-                matNode = node.GetSliceToRAS()
-                for col in range(0, len(matList)):
-                    for row in range(0, len(matList[col])):
-                        matNode.SetElement(col, row, matList[col][row])
-                node.UpdateMatrices()
-            fileObj.close()
+        if filename:
+            library = planelibrary.PlaneLibrary.load(filename)
+            names = library.names()
+            name = names[0]
+            if len(names) > 1:
+                name = qt.QInputDialog.getItem(self.interface.parent, "Load planes", "Preset:", names, 0, False)
+                if not name:
+                    return
+            self.applyPreset(library.getPreset(name))
 
+    # Kept for the modules using them, EasyClip itself goes through self.landmarkCodec
     def encodeJSON(self, input):
-        encodedString = json.dumps(input)
+        encodedString = json.dumps(input, separators=(',', ':'))
         encodedString = encodedString.replace('\"', '\'')
         return encodedString
 
     def decodeJSON(self, input):
         if input:
             input = input.replace('\'','\"')
-            return self.byteify(json.loads(input))
+            return json.loads(input)
         return None
 
     def byteify(self, input):
-        if isinstance(input, dict):
-            return {self.byteify(key):self.byteify(value) for key,value in input.items()}
-        elif isinstance(input, list):
-            return [self.byteify(element) for element in input]
-        elif isinstance(input, unicode):
-            return input.encode('utf-8')
-        else:
-            return input
+        # Strings are already unicode in python 3
+        return input
 
 class EasyClipTest(ScriptedLoadableModuleTest):
     def setUp(self):
@@ -644,8 +1238,11 @@ class EasyClipTest(ScriptedLoadableModuleTest):
         self.delayDisplay('planes are placed!')
 
         logic = EasyClipLogic(slicer.modules.EasyClipWidget)
-        logic.getCoord()
-        logic.clipping()
+        try:
+            logic.getCoord()
+            logic.clipping()
+        finally:
+            logic.cleanup()
 
         self.delayDisplay('Test passed!')
 
@@ -0,0 +1,5 @@
+#
+# Slicer-independent helpers of the EasyClip module.
+# Everything in this package only relies on vtk (and numpy), so it can be used
+# from the Slicer GUI as well as from a plain python interpreter (batch clipping).
+#
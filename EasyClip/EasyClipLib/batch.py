@@ -0,0 +1,254 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from . import compaction
+from . import engine
+from . import planelibrary
+from . import resultcache
+from . import streaming
+
+#
+# Headless batch clipping
+#
+# Usage (from the EasyClip module directory, with a python that provides vtk,
+# e.g. Slicer's PythonSlicer):
+#   python -m EasyClipLib.batch --planes planes.json --plane Red:neg --plane Green:pos \
+#       --output clipped/ scans/ other_scan.stl list_of_scans.txt
+#
+# --preset selects a preset of the plane library. Without it, a library with several presets
+# gives each mesh the preset named like the file (or with the file name as patientID).
+#
+# --max-memory clips the binary STL meshes out of core (see streaming.py): the meshes are never
+# loaded and each worker process stays below the given memory.
+#
+
+
+def collectInputs(paths):
+    # Each path is either a mesh, a directory of meshes or a manifest (text file, one mesh per line)
+    inputs = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in engine.MESH_EXTENSIONS:
+                    inputs.append(os.path.join(path, name))
+        elif os.path.splitext(path)[1].lower() in engine.MESH_EXTENSIONS:
+            inputs.append(path)
+        else:
+            manifestDirectory = os.path.dirname(os.path.abspath(path))
+            with open(path) as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        inputs.append(os.path.join(manifestDirectory, line))
+    return inputs
+
+
+def outputPathFor(inputPath, outputDirectory, suffix='', extension=None):
+    name, inputExtension = os.path.splitext(os.path.basename(inputPath))
+    return os.path.join(outputDirectory, name + suffix + (extension or inputExtension))
+
+
+def clipFileOutOfCore(inputPath, outputPath, planes, memoryLimit, result):
+    if not (inputPath.lower().endswith('.stl') and outputPath.lower().endswith('.stl')):
+        raise ValueError("Out of core clipping needs binary STL input and output meshes")
+    stats = streaming.clipStlFile(inputPath, outputPath, planes, memoryLimit)
+    result['cellsIn'] = stats['trianglesIn']
+    result['cellsOut'] = stats['trianglesOut']
+    result['bandCells'] = stats['bandTriangles']
+    result['workingBytes'] = stats['workingBytes']
+    result['peakMemoryBytes'] = stats['peakMemoryBytes']
+
+
+def clipFile(job):
+    # Runs in a worker process: only paths and plane tuples are sent, never vtk objects
+    inputPath, outputPath, planes, options, cache = job
+    options = dict(options)
+    compactionOptions = options.pop('compaction', None)
+    memoryLimit = options.pop('memoryLimit', None)
+    result = {'input': inputPath, 'output': outputPath}
+    start = time.time()
+    try:
+        if planes is None:
+            raise ValueError("No plane preset with clipping planes for this mesh")
+        if memoryLimit is not None:
+            clipFileOutOfCore(inputPath, outputPath, planes, memoryLimit, result)
+        else:
+            polyData = engine.readPolyData(inputPath)
+            result['cellsIn'] = polyData.GetNumberOfCells()
+            if cache is not None:
+                # cache: (directory, maxBytes), the directory is shared by the worker processes
+                resultCache = resultcache.ClipResultCache(*cache)
+                polyDataNew = resultCache.clipPolyData(engine.clipPolyData, polyData, planes, **options)
+                result['cached'] = resultCache.hits > 0
+            else:
+                polyDataNew = engine.clipPolyData(polyData, planes, **options)
+            if compactionOptions is not None and polyDataNew is not polyData and polyDataNew.GetNumberOfPoints():
+                polyDataNew, bytesBefore, bytesAfter = compaction.compactPolyData(polyDataNew, polyData,
+                                                                                  **compactionOptions)
+                result['bytesSaved'] = bytesBefore - bytesAfter
+            result['cellsOut'] = polyDataNew.GetNumberOfCells()
+            engine.writePolyData(polyDataNew, outputPath)
+        result['status'] = 'done'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def runBatch(inputs, outputDirectory, planes, processes=None, suffix='', extension=None, callback=None,
+             options=None, cache=None):
+    # options: keyword arguments of engine.clipPolyData, and 'compaction': keyword arguments of
+    # compaction.compactPolyData applied to the clipped meshes, or 'memoryLimit': bytes for the
+    # out of core clipping of binary STL meshes (the other options are then ignored)
+    # cache: (directory, maxBytes) of a resultcache.ClipResultCache, or None
+    if not os.path.isdir(outputDirectory):
+        os.makedirs(outputDirectory)
+    # planes: list of planes for all the inputs, or function giving the planes of an input
+    planesFor = planes if callable(planes) else (lambda inputPath: planes)
+    jobs = [(inputPath, outputPathFor(inputPath, outputDirectory, suffix, extension), planesFor(inputPath),
+             options or {}, cache)
+            for inputPath in inputs]
+    return runJobs(jobs, processes, callback)
+
+
+def runJobs(jobs, processes=None, callback=None):
+    # jobs: clipFile arguments. Returns the results, in the order the jobs finished
+    results = list()
+    if processes == 1:
+        resultIterator = map(clipFile, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        resultIterator = pool.imap_unordered(clipFile, jobs)
+    try:
+        for result in resultIterator:
+            results.append(result)
+            if callback:
+                callback(result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return results
+
+
+def addPlanes(planes, extraPlanes):
+    # planes: list or function of the input path, as in runBatch
+    if callable(planes):
+        def planesWithExtraPlanes(inputPath):
+            inputPlanes = planes(inputPath)
+            return None if inputPlanes is None else inputPlanes + extraPlanes
+        return planesWithExtraPlanes
+    return planes + extraPlanes
+
+
+def parsePlaneSides(values):
+    sides = dict()
+    for value in values:
+        color, _, side = value.partition(':')
+        color = color.capitalize()
+        if color not in engine.PLANE_COLORS or side not in ('neg', 'pos'):
+            raise argparse.ArgumentTypeError("Invalid plane '%s', expected e.g. Red:neg or Green:pos" % value)
+        sides[color] = side
+    return sides
+
+
+def printResult(result):
+    status = 'cached' if result.get('cached') else result['status']
+    print("%-6s %6.2fs %s" % (status, result['seconds'], result['input']))
+    if result.get('workingBytes') is not None:
+        print("       working memory %.0f MB, process peak %s" % (
+            result['workingBytes'] / 1024.0 ** 2,
+            "%.0f MB" % (result['peakMemoryBytes'] / 1024.0 ** 2) if result['peakMemoryBytes'] else "unknown"))
+    if result['status'] == 'failed':
+        print("       " + result['error'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clip meshes with planes saved by the EasyClip module.")
+    parser.add_argument('inputs', nargs='+', help="meshes, directories of meshes or text manifests")
+    parser.add_argument('--planes', required=True, help="plane library (or legacy plane file) saved with 'Save planes'")
+    parser.add_argument('--preset', default=None, help="preset of the plane library used for all the meshes")
+    parser.add_argument('--plane', action='append', default=[], metavar='COLOR:SIDE',
+                        help="plane to clip with and side to keep (neg/pos), e.g. Red:neg. Repeatable. "
+                             "Default: the planes saved in the preset.")
+    parser.add_argument('--box', default=None, metavar='XMIN,XMAX,YMIN,YMAX,ZMIN,ZMAX',
+                        help="also keep only the inside of this box, in the same clipping pass")
+    parser.add_argument('--output', required=True, help="output directory")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--suffix', default='', help="suffix added to the output file names")
+    parser.add_argument('--format', choices=[e[1:] for e in engine.MESH_EXTENSIONS], default=None,
+                        help="output format (default: same as input)")
+    parser.add_argument('--band', action='store_true',
+                        help="only run the clipper on the cells near the planes (faster on large meshes)")
+    parser.add_argument('--compact', action='store_true',
+                        help="merge the duplicated points and drop the unused points of the clipped meshes")
+    parser.add_argument('--float32', action='store_true', help="with --compact, store the points in single precision")
+    parser.add_argument('--arrays', choices=compaction.ARRAY_POLICIES, default=compaction.DEFAULT_OPTIONS['arrays'],
+                        help="with --compact, arrays kept in the clipped meshes: all of them, those of the input "
+                             "mesh, or none")
+    parser.add_argument('--cache-dir', default=None,
+                        help="directory of clipped meshes reused when the same mesh is clipped again with the same planes")
+    parser.add_argument('--cache-size', type=float, default=2.0, help="maximum size of the cache directory, in GB")
+    parser.add_argument('--max-memory', type=float, default=None, metavar='MB',
+                        help="clip binary STL meshes out of core, without loading them, using at most about this "
+                             "memory per process")
+    parser.add_argument('--report', default=None, help="write a JSON report of the run")
+    args = parser.parse_args(argv)
+    if args.max_memory and (args.compact or args.cache_dir or args.band):
+        parser.error("--compact, --cache-dir and --band cannot be used with --max-memory")
+
+    try:
+        sides = parsePlaneSides(args.plane)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    library = planelibrary.PlaneLibrary.load(args.planes)
+    if args.preset:
+        preset = library.getPreset(args.preset)
+        if not (sides or preset.sides):
+            parser.error("the preset has no clipping plane, use --plane")
+        planes = preset.planes(sides or None)
+    elif len(library.presets) == 1:
+        preset = library.getPreset(library.names()[0])
+        if not (sides or preset.sides):
+            parser.error("the plane file has no clipping plane, use --plane")
+        planes = preset.planes(sides or None)
+    else:
+        def planes(inputPath):
+            preset = library.findPresetFor(inputPath)
+            if preset is None or not (sides or preset.sides):
+                return None
+            return preset.planes(sides or None)
+    if args.box:
+        try:
+            box = engine.boxPlanes([float(value) for value in args.box.split(',')])
+        except (ValueError, IndexError):
+            parser.error("--box expects 6 comma separated numbers")
+        planes = addPlanes(planes, box)
+    inputs = collectInputs(args.inputs)
+    extension = '.' + args.format if args.format else None
+
+    start = time.time()
+    options = {'bandLimited': args.band}
+    if args.compact:
+        options['compaction'] = dict(compaction.DEFAULT_OPTIONS, float32=args.float32, arrays=args.arrays)
+    if args.max_memory:
+        options = {'memoryLimit': int(args.max_memory * 1024 ** 2)}
+    cache = (args.cache_dir, int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    results = runBatch(inputs, args.output, planes, args.processes, args.suffix, extension, printResult, options,
+                       cache)
+    failed = [result for result in results if result['status'] == 'failed']
+    print("%d meshes clipped, %d failed in %.1fs" % (len(results) - len(failed), len(failed), time.time() - start))
+    if args.report:
+        with open(args.report, 'w') as reportFile:
+            json.dump(results, reportFile, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from .transforms import matrixAsArray, transformKey
+
+#
+# World bounds of model nodes without hardening a copy of the model
+#
+
+# Points transformed at once, to bound the temporary memory on large meshes
+CHUNK_SIZE = 1000000
+
+
+def transformedPointsBounds(points, matrix):
+    # points: (N, 3) array, matrix: 4x4 array. Bounds of the transformed points
+    minimum = numpy.full(3, numpy.inf)
+    maximum = numpy.full(3, -numpy.inf)
+    for start in range(0, len(points), CHUNK_SIZE):
+        chunk = numpy.dot(points[start:start + CHUNK_SIZE], matrix[:3, :3].T) + matrix[:3, 3]
+        minimum = numpy.minimum(minimum, chunk.min(axis=0))
+        maximum = numpy.maximum(maximum, chunk.max(axis=0))
+    return [minimum[0], maximum[0], minimum[1], maximum[1], minimum[2], maximum[2]]
+
+
+def unionBounds(boundsList):
+    bounds = None
+    for tempbound in boundsList:
+        if bounds is None:
+            bounds = list(tempbound)
+            continue
+        for axis in range(3):
+            bounds[axis * 2] = min(bounds[axis * 2], tempbound[axis * 2])
+            bounds[axis * 2 + 1] = max(bounds[axis * 2 + 1], tempbound[axis * 2 + 1])
+    return bounds
+
+
+class BoundsCache(object):
+    # World bounds memoized per model node, on the MTimes of its polydata and of its transform to world
+    def __init__(self):
+        # node ID -> (key, bounds)
+        self.cache = dict()
+
+    def getWorldBounds(self, modelNode):
+        polyData = modelNode.GetPolyData()
+        if polyData is None or polyData.GetNumberOfPoints() == 0:
+            return None
+        transformNode = modelNode.GetParentTransformNode()
+        key = (polyData.GetMTime(), transformKey(transformNode))
+        cached = self.cache.get(modelNode.GetID())
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        bounds = self.computeWorldBounds(polyData, transformNode)
+        self.cache[modelNode.GetID()] = (key, bounds)
+        return bounds
+
+    def computeWorldBounds(self, polyData, transformNode):
+        if transformNode is None:
+            return list(polyData.GetBounds())
+        if transformNode.IsTransformToWorldLinear():
+            matrix = vtk.vtkMatrix4x4()
+            transformNode.GetMatrixTransformToWorld(matrix)
+            points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+            return transformedPointsBounds(points, matrixAsArray(matrix))
+        # Non-linear transform: only the points are transformed, not the whole polydata
+        transform = vtk.vtkGeneralTransform()
+        transformNode.GetTransformToWorld(transform)
+        points = vtk.vtkPoints()
+        transform.TransformPoints(polyData.GetPoints(), points)
+        return list(points.GetBounds())
+
+    def remove(self, nodeID):
+        self.cache.pop(nodeID, None)
+
+    def clear(self):
+        self.cache = dict()
@@ -0,0 +1,61 @@
+import vtk
+
+#
+# Compaction of the clipped meshes
+#
+# vtkClipClosedSurface outputs double precision points, points duplicated along the cut, the
+# points of the removed cells and a cell array of labels. Both the clipped mesh and its undo
+# snapshot stay in memory, so the clipped mesh is cleaned before it replaces the model:
+#   mergePoints  merge the coincident points (the unused points are always dropped)
+#   float32      store the points in single precision (lossy, off by default)
+#   arrays       'keep' all the arrays, 'input' only those of the mesh before the clip,
+#                'strip' all of them except the ones named in keepArrays
+#
+
+ARRAY_POLICIES = ('keep', 'input', 'strip')
+DEFAULT_OPTIONS = {'mergePoints': True, 'float32': False, 'arrays': 'input', 'keepArrays': ['Normals']}
+
+
+def arrayNames(attributes):
+    return [attributes.GetArrayName(index) for index in range(attributes.GetNumberOfArrays())]
+
+
+def removeArrays(polyData, keep):
+    # keep(attributeType, name): True for the arrays to keep. attributeType: 'point' or 'cell'
+    for attributeType, attributes in (('point', polyData.GetPointData()), ('cell', polyData.GetCellData())):
+        for name in arrayNames(attributes):
+            if name is not None and not keep(attributeType, name):
+                attributes.RemoveArray(name)
+
+
+def compactPolyData(polyData, inputPolyData=None, mergePoints=True, float32=False, arrays='input',
+                    keepArrays=()):
+    # Returns the compacted mesh, and its size in bytes before and after
+    if arrays not in ARRAY_POLICIES:
+        raise ValueError("Unknown array policy '%s', expected one of %s" % (arrays, ", ".join(ARRAY_POLICIES)))
+    bytesBefore = polyData.GetActualMemorySize() * 1024
+    cleaner = vtk.vtkCleanPolyData()
+    cleaner.SetInputData(polyData)
+    cleaner.SetPointMerging(mergePoints)
+    # Only the exactly coincident points are merged: the mesh is not changed
+    cleaner.ToleranceIsAbsoluteOn()
+    cleaner.SetAbsoluteTolerance(0.0)
+    cleaner.ConvertLinesToPointsOff()
+    cleaner.ConvertPolysToLinesOff()
+    cleaner.ConvertStripsToPolysOff()
+    if float32:
+        cleaner.SetOutputPointsPrecision(vtk.vtkAlgorithm.SINGLE_PRECISION)
+    else:
+        cleaner.SetOutputPointsPrecision(vtk.vtkAlgorithm.DEFAULT_PRECISION)
+    cleaner.Update()
+    compacted = vtk.vtkPolyData()
+    compacted.ShallowCopy(cleaner.GetOutput())
+    if arrays == 'input' and inputPolyData is not None:
+        inputArrays = {'point': set(arrayNames(inputPolyData.GetPointData())),
+                       'cell': set(arrayNames(inputPolyData.GetCellData()))}
+        removeArrays(compacted, lambda attributeType, name: name in inputArrays[attributeType] or name in keepArrays)
+    elif arrays == 'strip':
+        removeArrays(compacted, lambda attributeType, name: name in keepArrays)
+    # Releases the memory reserved by the filter beyond the data
+    compacted.Squeeze()
+    return compacted, bytesBefore, compacted.GetActualMemorySize() * 1024
@@ -0,0 +1,460 @@
+import concurrent.futures
+import os
+import time
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from . import compaction as meshcompaction
+from . import polydata
+
+#
+# Clipping engine
+#
+# A plane is given as a tuple (origin, normal) in the coordinate system of the mesh.
+# vtkClipClosedSurface keeps the part of the mesh the normals point to.
+#
+
+PLANE_COLORS = ('Red', 'Yellow', 'Green')
+# Position of a mesh relative to a set of planes
+KEPT = 'kept'
+REMOVED = 'removed'
+CROSSED = 'crossed'
+MESH_EXTENSIONS = ('.vtk', '.vtp', '.stl', '.ply')
+# Point data array used to find the original points in the output of the band clipping
+ORIGINAL_ID_ARRAY_NAME = 'EasyClipOriginalPointId'
+# Points merged when a half of a split is closed by its cap, as a fraction of the bounding box diagonal:
+# vtkClipPolyData and vtkCutter do not compute exactly the same points on the cut contour
+SPLIT_MERGE_TOLERANCE = 1e-6
+
+
+def planeFromMatrix(matrix, side):
+    # Same convention as EasyClipLogic.getCoord: the normal is the Z axis of the
+    # SliceToRAS matrix and the point is its translation
+    origin = [matrix[0][3], matrix[1][3], matrix[2][3]]
+    normal = [matrix[0][2], matrix[1][2], matrix[2][2]]
+    if side == 'neg':
+        normal = [-normal[0], -normal[1], -normal[2]]
+    return origin, normal
+
+
+def planesFromMatrices(matrices, sides):
+    # sides: {color: 'neg' or 'pos'} for each plane used for the clipping
+    planes = list()
+    for color in PLANE_COLORS:
+        if color in sides:
+            planes.append(planeFromMatrix(matrices[color], sides[color]))
+    return planes
+
+
+def orientedBoxPlanes(center, axes, radii):
+    # 6 planes keeping the inside of a box. axes: 3 unit vectors, radii: half sizes along them
+    planes = list()
+    for axis, radius in zip(axes, radii):
+        for sign in (1, -1):
+            origin = [center[i] + sign * radius * axis[i] for i in range(3)]
+            normal = [-sign * axis[i] for i in range(3)]
+            planes.append((origin, normal))
+    return planes
+
+
+def boxPlanes(bounds):
+    # Axis aligned box (xmin, xmax, ymin, ymax, zmin, zmax)
+    center = [(bounds[2 * i] + bounds[2 * i + 1]) / 2.0 for i in range(3)]
+    radii = [(bounds[2 * i + 1] - bounds[2 * i]) / 2.0 for i in range(3)]
+    return orientedBoxPlanes(center, ((1, 0, 0), (0, 1, 0), (0, 0, 1)), radii)
+
+
+def buildPlaneCollection(planes):
+    # New vtkPlane objects on every call, so each clipper owns its planes
+    planeCollection = vtk.vtkPlaneCollection()
+    for origin, normal in planes:
+        plane = vtk.vtkPlane()
+        plane.SetOrigin(origin[0], origin[1], origin[2])
+        plane.SetNormal(normal[0], normal[1], normal[2])
+        planeCollection.AddItem(plane)
+    return planeCollection
+
+
+def createClipper(polyData, planes, progressCallback=None, abortEvent=None):
+    # progressCallback(fraction) is called on the VTK progress events of the clipper and
+    # abortEvent (threading.Event) stops it when set
+    clipper = vtk.vtkClipClosedSurface()
+    clipper.SetClippingPlanes(buildPlaneCollection(planes))
+    clipper.SetInputData(polyData)
+    clipper.SetGenerateFaces(1)
+    clipper.SetScalarModeToLabels()
+    if progressCallback is not None or abortEvent is not None:
+        def onProgress(caller, event):
+            if abortEvent is not None and abortEvent.is_set():
+                caller.SetAbortExecute(1)
+            if progressCallback is not None:
+                progressCallback(caller.GetProgress())
+        clipper.AddObserver(vtk.vtkCommand.ProgressEvent, onProgress)
+    return clipper
+
+
+def classifyBounds(bounds, planes):
+    corners = numpy.array([[x, y, z] for x in bounds[0:2] for y in bounds[2:4] for z in bounds[4:6]])
+    return classifyPoints(corners, planes)
+
+
+def classifyPoints(points, planes):
+    # points: (N, 3) array. Signed distances of all the points to each plane, in one numpy pass per plane
+    kept = True
+    for origin, normal in planes:
+        distances = numpy.dot(points - numpy.asarray(origin, dtype=float)[:3], numpy.asarray(normal, dtype=float)[:3])
+        if distances.max() < 0:
+            return REMOVED
+        if distances.min() < 0:
+            kept = False
+    return KEPT if kept else CROSSED
+
+
+def classifyPolyData(polyData, planes):
+    # Cheap test before running vtkClipClosedSurface: the 8 corners of the bounding box first,
+    # then all the points if the box crosses a plane
+    if not planes or polyData.GetNumberOfPoints() == 0:
+        return KEPT
+    position = classifyBounds(polyData.GetBounds(), planes)
+    if position != CROSSED:
+        return position
+    return classifyPoints(numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()), planes)
+
+
+def runClipper(polyData, planes, progressCallback=None, abortEvent=None):
+    clipper = createClipper(polyData, planes, progressCallback, abortEvent)
+    clipper.Update()
+    return clipper.GetOutput()
+
+
+def clipPolyData(polyData, planes, bandLimited=False, progressCallback=None, abortEvent=None):
+    # Models that are not crossed by any plane are returned as is (no copy)
+    # and models that are completely removed are returned empty without running the clipper
+    position = classifyPolyData(polyData, planes)
+    if position == KEPT:
+        return polyData
+    if position == REMOVED:
+        return vtk.vtkPolyData()
+    if bandLimited:
+        return clipPolyDataBand(polyData, planes, progressCallback=progressCallback, abortEvent=abortEvent)
+    return runClipper(polyData, planes, progressCallback, abortEvent)
+
+
+class ClipJob(object):
+    # One mesh to clip, with the planes in its own coordinate system.
+    # key identifies the mesh for the caller (model node ID, file name...)
+    # If the mesh has a non-linear transform, the planes are in world coordinates instead:
+    # toWorld and fromWorld are then the vtkAbstractTransforms between the mesh and the world
+    def __init__(self, key, polyData, planes, name=None, toWorld=None, fromWorld=None):
+        self.key = key
+        self.name = name or key
+        self.polyData = polyData
+        self.planes = planes
+        self.toWorld = toWorld
+        self.fromWorld = fromWorld
+        self.result = None
+        # Time spent clipping, in seconds
+        self.seconds = None
+        # Split mode: removed part of the mesh, the result being the kept part
+        self.removed = None
+        # Size of the result before and after its compaction, in bytes
+        self.bytesBeforeCompaction = None
+        self.bytesAfterCompaction = None
+
+
+def clipJobs(jobs, options=None, progressCallback=None, abortEvent=None, maxWorkers=1, cache=None,
+             compaction=None):
+    # Clips the jobs, on a pool of maxWorkers threads if more than one (the vtk filters release
+    # the GIL and every job has its own planes and clipper). progressCallback(jobIndex, fraction).
+    # cache: resultcache.ClipResultCache reused for the meshes without a non-linear transform.
+    # compaction: keyword arguments of compaction.compactPolyData applied to the clipped meshes, or None
+    # Returns False if abortEvent was set, the results are then incomplete
+    options = options or {}
+
+    def clipJob(index):
+        job = jobs[index]
+        if abortEvent is not None and abortEvent.is_set():
+            return
+        jobProgress = None
+        if progressCallback is not None:
+            jobProgress = lambda fraction: progressCallback(index, fraction)
+        start = time.perf_counter()
+        if job.toWorld is None and cache is not None:
+            job.result = cache.clipPolyData(clipPolyData, job.polyData, job.planes, progressCallback=jobProgress,
+                                            abortEvent=abortEvent, **options)
+        elif job.toWorld is None:
+            job.result = clipPolyData(job.polyData, job.planes, progressCallback=jobProgress,
+                                      abortEvent=abortEvent, **options)
+        else:
+            job.result = clipPolyDataInWorld(job.polyData, job.planes, job.toWorld, job.fromWorld,
+                                             progressCallback=jobProgress, abortEvent=abortEvent, **options)
+        if compaction is not None and job.result is not job.polyData and job.result.GetNumberOfPoints():
+            job.result, job.bytesBeforeCompaction, job.bytesAfterCompaction = meshcompaction.compactPolyData(
+                job.result, job.polyData, **compaction)
+        job.seconds = time.perf_counter() - start
+        if progressCallback is not None:
+            progressCallback(index, 1.0)
+
+    if maxWorkers > 1 and len(jobs) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(maxWorkers, len(jobs))) as executor:
+            for future in [executor.submit(clipJob, index) for index in range(len(jobs))]:
+                # Raises the exception of the job, if any
+                future.result()
+    else:
+        for index in range(len(jobs)):
+            clipJob(index)
+    return not (abortEvent is not None and abortEvent.is_set())
+
+
+def transformPolyData(polyData, transform):
+    transformFilter = vtk.vtkTransformPolyDataFilter()
+    transformFilter.SetInputData(polyData)
+    transformFilter.SetTransform(transform)
+    transformFilter.Update()
+    output = vtk.vtkPolyData()
+    output.ShallowCopy(transformFilter.GetOutput())
+    return output
+
+
+def clipPolyDataInWorld(polyData, planes, toWorld, fromWorld, **options):
+    # Non-linear transforms cannot be applied to the planes: the mesh is clipped in world
+    # coordinates and the result is moved back to the coordinates of the mesh
+    worldPolyData = transformPolyData(polyData, toWorld)
+    clipped = clipPolyData(worldPolyData, planes, **options)
+    if clipped is worldPolyData:
+        return polyData
+    if clipped.GetNumberOfPoints() == 0:
+        return clipped
+    return transformPolyData(clipped, fromWorld)
+
+
+def clipPolyDataBand(polyData, planes, ring=1, progressCallback=None, abortEvent=None):
+    # Only the triangles touching a plane, plus `ring` layers of neighbours, go through
+    # vtkClipClosedSurface. The caps only depend on the cut contours, which all lie in this band,
+    # so the clipped band stitched back to the untouched triangles gives the same closed surface.
+    triangles = polydata.trianglesAsArray(polyData)
+    if triangles is None:
+        return runClipper(polyData, planes, progressCallback, abortEvent)
+    points = polydata.pointsAsArray(polyData)
+    removed = numpy.zeros(len(triangles), dtype=bool)
+    band = numpy.zeros(len(triangles), dtype=bool)
+    for origin, normal in planes:
+        distances = numpy.dot(points - numpy.asarray(origin, dtype=float)[:3],
+                              numpy.asarray(normal, dtype=float)[:3])[triangles]
+        removed |= distances.max(axis=1) < 0
+        band |= distances.min(axis=1) <= 0
+    band &= ~removed
+    for _ in range(ring):
+        touched = numpy.zeros(len(points), dtype=bool)
+        touched[triangles[band]] = True
+        band |= touched[triangles].any(axis=1) & ~removed
+    kept = ~(removed | band)
+
+    bandPolyData, bandPointIds = polydata.extractTriangles(polyData, triangles[band])
+    originalIds = numpy_support.numpy_to_vtk(bandPointIds.astype(numpy.float64), deep=1)
+    originalIds.SetName(ORIGINAL_ID_ARRAY_NAME)
+    bandPolyData.GetPointData().AddArray(originalIds)
+    clipper = createClipper(bandPolyData, planes, progressCallback, abortEvent)
+    # The original ids and the arrays of the input are interpolated on the points of the clipped band
+    clipper.PassPointDataOn()
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputConnection(clipper.GetOutputPort())
+    triangleFilter.PassVertsOff()
+    triangleFilter.PassLinesOff()
+    triangleFilter.Update()
+    bandOutput = triangleFilter.GetOutput()
+    bandTriangles = polydata.trianglesAsArray(bandOutput)
+    if bandTriangles is None:
+        bandTriangles = numpy.zeros((0, 3), dtype=triangles.dtype)
+        bandPoints = numpy.zeros((0, 3), dtype=points.dtype)
+        candidates = numpy.zeros(0, dtype=numpy.int64)
+    else:
+        bandPoints = polydata.pointsAsArray(bandOutput)
+        candidates = numpy.rint(numpy_support.vtk_to_numpy(
+            bandOutput.GetPointData().GetArray(ORIGINAL_ID_ARRAY_NAME))).astype(numpy.int64)
+        numpy.clip(candidates, 0, len(points) - 1, out=candidates)
+
+    # Points of the clipped band that are original points (same id and same position) are
+    # merged with the untouched triangles, the others are new points created on the planes
+    isOriginal = (points[candidates] == bandPoints).all(axis=1)
+    isNew = ~isOriginal
+    bandToOutput = numpy.where(isOriginal, candidates, len(points) + numpy.cumsum(isNew) - 1)
+    allPoints = numpy.concatenate((points, bandPoints[isNew].astype(points.dtype)))
+    allTriangles = numpy.concatenate((triangles[kept], bandToOutput[bandTriangles]))
+    usedIds, outputTriangles = numpy.unique(allTriangles.ravel(), return_inverse=True)
+    output = polydata.polyDataFromArrays(allPoints[usedIds], outputTriangles.reshape(-1, 3))
+
+    inputPointData = polyData.GetPointData()
+    for index in range(inputPointData.GetNumberOfArrays()):
+        array = inputPointData.GetArray(index)
+        if array is None or not array.GetName():
+            continue
+        bandArray = bandOutput.GetPointData().GetArray(array.GetName())
+        if bandArray is None:
+            continue
+        values = numpy.concatenate((numpy_support.vtk_to_numpy(array),
+                                    numpy_support.vtk_to_numpy(bandArray)[isNew]))[usedIds]
+        newArray = numpy_support.numpy_to_vtk(values, deep=1, array_type=array.GetDataType())
+        newArray.SetName(array.GetName())
+        output.GetPointData().AddArray(newArray)
+    normals = inputPointData.GetNormals()
+    if normals is not None and normals.GetName() and output.GetPointData().HasArray(normals.GetName()):
+        output.GetPointData().SetActiveNormals(normals.GetName())
+    # Same cell labels as the clipper: 0 for the untouched triangles
+    bandScalars = bandOutput.GetCellData().GetScalars()
+    if bandScalars is not None:
+        bandLabels = numpy_support.vtk_to_numpy(bandScalars)
+        labels = numpy.concatenate((numpy.zeros(int(kept.sum()), dtype=bandLabels.dtype), bandLabels))
+        labelArray = numpy_support.numpy_to_vtk(labels, deep=1, array_type=bandScalars.GetDataType())
+        labelArray.SetName(bandScalars.GetName())
+        output.GetCellData().SetScalars(labelArray)
+    return output
+
+
+def appendPolyData(pieces, merge=True, tolerance=0.0):
+    # tolerance: for merge, distance under which points are merged, as a fraction of the bounding box diagonal
+    pieces = [piece for piece in pieces if piece is not None and piece.GetNumberOfCells()]
+    if not pieces:
+        return vtk.vtkPolyData()
+    if len(pieces) == 1 and not merge:
+        return pieces[0]
+    append = vtk.vtkAppendPolyData()
+    for piece in pieces:
+        append.AddInputData(piece)
+    if not merge:
+        append.Update()
+        return append.GetOutput()
+    # The cap shares the points of the cut contour with the surface: merged, the half is closed
+    cleaner = vtk.vtkCleanPolyData()
+    cleaner.SetInputConnection(append.GetOutputPort())
+    if tolerance:
+        cleaner.ToleranceIsAbsoluteOff()
+        cleaner.SetTolerance(tolerance)
+    else:
+        cleaner.ToleranceIsAbsoluteOn()
+        cleaner.SetAbsoluteTolerance(0.0)
+    cleaner.ConvertLinesToPointsOff()
+    cleaner.ConvertPolysToLinesOff()
+    cleaner.ConvertStripsToPolysOff()
+    cleaner.Update()
+    return cleaner.GetOutput()
+
+
+def orientedCap(cap, direction):
+    # Triangles of the cap, all turned so that their normals point in direction (outside of the half they close)
+    triangles = polydata.trianglesAsArray(cap)
+    if triangles is None:
+        return cap
+    points = polydata.pointsAsArray(cap)
+    corners = points[triangles]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    flipped = numpy.dot(normals, numpy.asarray(direction, dtype=float)[:3]) < 0
+    triangles = triangles.copy()
+    triangles[flipped] = triangles[flipped][:, ::-1]
+    return polydata.polyDataFromArrays(points, triangles)
+
+
+def splitPolyDataByPlane(polyData, origin, normal):
+    # Both sides of the mesh, each closed by the same cap: the cut contour is computed and
+    # triangulated once. Returns (side the normal points to, other side)
+    plane = vtk.vtkPlane()
+    plane.SetOrigin(*origin[:3])
+    plane.SetNormal(*normal[:3])
+    clipper = vtk.vtkClipPolyData()
+    clipper.SetInputData(polyData)
+    clipper.SetClipFunction(plane)
+    clipper.GenerateClippedOutputOn()
+    clipper.Update()
+    cutter = vtk.vtkCutter()
+    cutter.SetInputData(polyData)
+    cutter.SetCutFunction(plane)
+    triangulator = vtk.vtkContourTriangulator()
+    triangulator.SetInputConnection(cutter.GetOutputPort())
+    triangulator.Update()
+    cap = triangulator.GetOutput()
+    # The arrays interpolated on the cap (normals...) would be wrong: both halves lose them in the append
+    kept = appendPolyData([clipper.GetOutput(), orientedCap(cap, [-x for x in normal[:3]])],
+                          tolerance=SPLIT_MERGE_TOLERANCE)
+    removed = appendPolyData([clipper.GetClippedOutput(), orientedCap(cap, normal)], tolerance=SPLIT_MERGE_TOLERANCE)
+    return kept, removed
+
+
+def splitPolyData(polyData, planes):
+    # Kept part (on the kept side of all the planes) and removed part of the mesh. The planes are
+    # applied one after the other on the kept part, the removed part gathers the pieces cut by each plane
+    kept = polyData
+    removedPieces = list()
+    for origin, normal in planes:
+        position = classifyPolyData(kept, [(origin, normal)])
+        if position == KEPT:
+            continue
+        if position == REMOVED:
+            removedPieces.append(kept)
+            kept = vtk.vtkPolyData()
+            break
+        kept, removed = splitPolyDataByPlane(kept, origin, normal)
+        removedPieces.append(removed)
+    return kept, appendPolyData(removedPieces, merge=False)
+
+
+def splitJobs(jobs, maxWorkers=1):
+    # Split mode of clipJobs: job.result is the kept part and job.removed the removed part
+    def splitJob(job):
+        start = time.perf_counter()
+        if job.toWorld is None:
+            job.result, job.removed = splitPolyData(job.polyData, job.planes)
+        else:
+            kept, removed = splitPolyData(transformPolyData(job.polyData, job.toWorld), job.planes)
+            job.result = transformPolyData(kept, job.fromWorld) if kept.GetNumberOfCells() else kept
+            job.removed = transformPolyData(removed, job.fromWorld) if removed.GetNumberOfCells() else removed
+            if not job.removed.GetNumberOfCells():
+                job.result = job.polyData
+        job.seconds = time.perf_counter() - start
+
+    if maxWorkers > 1 and len(jobs) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(maxWorkers, len(jobs))) as executor:
+            for future in [executor.submit(splitJob, job) for job in jobs]:
+                future.result()
+    else:
+        for job in jobs:
+            splitJob(job)
+
+
+def readPolyData(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.vtk':
+        reader = vtk.vtkPolyDataReader()
+    elif extension == '.vtp':
+        reader = vtk.vtkXMLPolyDataReader()
+    elif extension == '.stl':
+        reader = vtk.vtkSTLReader()
+    elif extension == '.ply':
+        reader = vtk.vtkPLYReader()
+    else:
+        raise ValueError("Unsupported mesh format: %s" % filename)
+    reader.SetFileName(filename)
+    reader.Update()
+    return reader.GetOutput()
+
+
+def writePolyData(polyData, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.vtk':
+        writer = vtk.vtkPolyDataWriter()
+        writer.SetFileTypeToBinary()
+    elif extension == '.vtp':
+        writer = vtk.vtkXMLPolyDataWriter()
+    elif extension == '.stl':
+        writer = vtk.vtkSTLWriter()
+        writer.SetFileTypeToBinary()
+    elif extension == '.ply':
+        writer = vtk.vtkPLYWriter()
+        writer.SetFileTypeToBinary()
+    else:
+        raise ValueError("Unsupported mesh format: %s" % filename)
+    writer.SetFileName(filename)
+    writer.SetInputData(polyData)
+    if not writer.Write():
+        raise IOError("Could not write %s" % filename)
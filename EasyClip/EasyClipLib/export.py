@@ -0,0 +1,130 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
+import vtk
+
+#
+# Export of the clipped models in background threads
+#
+# The main thread submits the meshes and calls dispatch() regularly (e.g. from a QTimer): each mesh
+# is copied when it is handed to the writer threads, as long as the copies waiting or being written
+# stay below maxQueueBytes, so that the models can be clipped again meanwhile without holding more
+# than maxQueueBytes of copies. The writer threads write zlib compressed binary .vtp, or binary
+# .ply/.stl, and record the size, time and throughput of each file.
+#
+
+EXPORT_FORMATS = ('.vtp', '.ply', '.stl')
+DONE = 'done'
+FAILED = 'failed'
+
+
+def writeCompressedPolyData(polyData, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.vtp':
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()
+        writer.SetCompressorTypeToZLib()
+    elif extension == '.ply':
+        writer = vtk.vtkPLYWriter()
+        writer.SetFileTypeToBinary()
+    elif extension == '.stl':
+        writer = vtk.vtkSTLWriter()
+        writer.SetFileTypeToBinary()
+    else:
+        raise ValueError("Unsupported export format: %s" % filename)
+    # Written next to the destination first, so an interrupted export never leaves a truncated file
+    temporaryFilename = "%s.%d.tmp%s" % (filename, threading.current_thread().ident, extension)
+    writer.SetFileName(temporaryFilename)
+    writer.SetInputData(polyData)
+    if not writer.Write():
+        if os.path.exists(temporaryFilename):
+            os.remove(temporaryFilename)
+        raise IOError("Could not write %s" % filename)
+    os.replace(temporaryFilename, filename)
+
+
+class BackgroundWriter(object):
+    def __init__(self, maxWorkers=2, maxQueueBytes=512 * 1024 * 1024):
+        self.maxQueueBytes = maxQueueBytes
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+        # (name, polyData, filename) not handed to the threads yet
+        self.pending = collections.deque()
+        # Bytes of the copies waiting or being written
+        self.queuedBytes = 0
+        self.submitted = 0
+        # Written by the writer threads, read by the main thread
+        self.lock = threading.Lock()
+        self.results = list()
+        self.futures = list()
+
+    def submit(self, name, polyData, filename):
+        self.pending.append((name, polyData, filename))
+        self.submitted += 1
+
+    def dispatch(self):
+        # Main thread: hands the pending meshes to the threads while the queue has room.
+        # A mesh larger than maxQueueBytes is handed alone
+        while self.pending:
+            name, polyData, filename = self.pending[0]
+            nbytes = polyData.GetActualMemorySize() * 1024
+            with self.lock:
+                if self.queuedBytes and self.queuedBytes + nbytes > self.maxQueueBytes:
+                    return
+                self.queuedBytes += nbytes
+            self.pending.popleft()
+            copy = vtk.vtkPolyData()
+            copy.DeepCopy(polyData)
+            self.futures.append(self.executor.submit(self.write, name, copy, filename, nbytes))
+
+    def write(self, name, polyData, filename, nbytes):
+        result = {'name': name, 'filename': filename}
+        start = time.perf_counter()
+        try:
+            writeCompressedPolyData(polyData, filename)
+            result['status'] = DONE
+            result['bytes'] = os.path.getsize(filename)
+        except Exception as e:
+            result['status'] = FAILED
+            result['error'] = str(e)
+        result['seconds'] = time.perf_counter() - start
+        if result['status'] == DONE:
+            result['megabytesPerSecond'] = result['bytes'] / 1024.0 ** 2 / max(result['seconds'], 1e-6)
+        with self.lock:
+            self.queuedBytes -= nbytes
+            self.results.append(result)
+
+    def isRunning(self):
+        return bool(self.pending) or not all(future.done() for future in self.futures)
+
+    def wait(self):
+        # Without a main loop: dispatches and waits until all the meshes are written
+        while self.isRunning():
+            self.dispatch()
+            time.sleep(0.01)
+        return self.results
+
+    def shutdown(self):
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+    @property
+    def progress(self):
+        if not self.submitted:
+            return 1.0
+        return len(self.results) / float(self.submitted)
+
+    def summary(self):
+        with self.lock:
+            results = list(self.results)
+        done = [result for result in results if result['status'] == DONE]
+        seconds = sum(result['seconds'] for result in done)
+        totalBytes = sum(result['bytes'] for result in done)
+        return {'files': len(results),
+                'done': len(done),
+                'failed': len(results) - len(done),
+                'bytes': totalBytes,
+                'megabytesPerSecond': totalBytes / 1024.0 ** 2 / seconds if seconds else None}
@@ -0,0 +1,186 @@
+import collections
+import zlib
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from . import polydata
+
+#
+# Undo/redo history of the clip operations
+#
+
+CELL_TYPES = ('Verts', 'Lines', 'Polys', 'Strips')
+
+
+def packArray(values, compressionLevel):
+    values = numpy.ascontiguousarray(values)
+    return values.dtype.str, values.shape, zlib.compress(values.tobytes(), compressionLevel)
+
+
+def unpackArray(packed):
+    dtype, shape, data = packed
+    return numpy.frombuffer(zlib.decompress(data), dtype=numpy.dtype(dtype)).reshape(shape)
+
+
+class PolyDataSnapshot(object):
+    # Compressed copy of a vtkPolyData: connectivity and numeric arrays are zlib packed,
+    # points are either kept exact or quantized on quantizationBits bits over their bounding box
+    def __init__(self, polyData, quantizationBits=None, compressionLevel=1):
+        self.points = None
+        self.pointsOrigin = None
+        self.pointsScale = None
+        self.pointsDataType = None
+        if polyData.GetPoints() is not None:
+            points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+            self.pointsDataType = polyData.GetPoints().GetDataType()
+            if quantizationBits and len(points):
+                self.pointsOrigin = points.min(axis=0).astype(numpy.float64)
+                extent = numpy.maximum(points.max(axis=0) - self.pointsOrigin, 1e-12)
+                self.pointsScale = extent / (2 ** quantizationBits - 1)
+                dtype = numpy.uint16 if quantizationBits <= 16 else numpy.uint32
+                points = numpy.rint((points - self.pointsOrigin) / self.pointsScale).astype(dtype)
+            self.points = packArray(points, compressionLevel)
+        self.cells = dict()
+        for cellType in CELL_TYPES:
+            cellArray = getattr(polyData, 'Get' + cellType)()
+            if cellArray.GetNumberOfCells():
+                self.cells[cellType] = (cellArray.GetNumberOfCells(),
+                                        packArray(numpy_support.vtk_to_numpy(cellArray.GetData()), compressionLevel))
+        self.pointData = self.packAttributes(polyData.GetPointData(), compressionLevel)
+        self.cellData = self.packAttributes(polyData.GetCellData(), compressionLevel)
+        self.nbytes = sum(len(packed[2]) for packed in self.packedArrays())
+
+    def packAttributes(self, attributes, compressionLevel):
+        arrays = list()
+        for index in range(attributes.GetNumberOfArrays()):
+            array = attributes.GetArray(index)
+            if array is None:
+                continue
+            arrays.append((array.GetName(), array.GetDataType(),
+                           packArray(numpy_support.vtk_to_numpy(array), compressionLevel)))
+        active = dict()
+        for attribute in ('Scalars', 'Normals', 'TCoords'):
+            array = getattr(attributes, 'Get' + attribute)()
+            if array is not None and array.GetName():
+                active[attribute] = array.GetName()
+        return arrays, active
+
+    def packedArrays(self):
+        if self.points:
+            yield self.points
+        for numberOfCells, packed in self.cells.values():
+            yield packed
+        for arrays, active in (self.pointData, self.cellData):
+            for name, dataType, packed in arrays:
+                yield packed
+
+    def unpackAttributes(self, packedAttributes, attributes):
+        arrays, active = packedAttributes
+        for name, dataType, packed in arrays:
+            array = numpy_support.numpy_to_vtk(unpackArray(packed), deep=1, array_type=dataType)
+            if name:
+                array.SetName(name)
+            attributes.AddArray(array)
+        for attribute, name in active.items():
+            getattr(attributes, 'SetActive' + attribute)(name)
+
+    def restore(self):
+        polyData = vtk.vtkPolyData()
+        if self.points:
+            points = unpackArray(self.points)
+            if self.pointsScale is not None:
+                points = points * self.pointsScale + self.pointsOrigin
+            vtkPoints = vtk.vtkPoints()
+            vtkPoints.SetData(numpy_support.numpy_to_vtk(points, deep=1, array_type=self.pointsDataType))
+            polyData.SetPoints(vtkPoints)
+        for cellType, (numberOfCells, packed) in self.cells.items():
+            cellArray = vtk.vtkCellArray()
+            cellArray.SetCells(numberOfCells, numpy_support.numpy_to_vtkIdTypeArray(
+                unpackArray(packed).astype(polydata.ID_TYPE), deep=1))
+            getattr(polyData, 'Set' + cellType)(cellArray)
+        self.unpackAttributes(self.pointData, polyData.GetPointData())
+        self.unpackAttributes(self.cellData, polyData.GetCellData())
+        return polyData
+
+
+class ModelRecord(object):
+    # What is needed to add a model node back to the scene
+    def __init__(self, name, snapshot, transformNodeID=None, color=None):
+        self.name = name
+        self.snapshot = snapshot
+        self.transformNodeID = transformNodeID
+        self.color = color
+
+
+class ClipStep(object):
+    # State of the scene before a clip (or before an undo, for the redo stack)
+    def __init__(self):
+        # model node ID -> PolyDataSnapshot
+        self.models = dict()
+        # node ID -> {attribute name: value}
+        self.attributes = dict()
+        # Models added by the clip (split mode), removed to restore the step
+        self.createdModelIDs = list()
+        # ModelRecords of the models removed since the step, added back to restore it
+        self.removedModels = list()
+
+    @property
+    def nbytes(self):
+        return (sum(snapshot.nbytes for snapshot in self.models.values())
+                + sum(record.snapshot.nbytes for record in self.removedModels))
+
+
+class ClipHistory(object):
+    # Undo and redo stacks, kept under byteBudget by dropping the oldest undo steps first.
+    # The most recent step is always kept so that the last clip can be undone.
+    def __init__(self, byteBudget=512 * 1024 * 1024, quantizationBits=None):
+        self.byteBudget = byteBudget
+        self.quantizationBits = quantizationBits
+        self.undoStack = collections.deque()
+        self.redoStack = list()
+
+    def snapshot(self, polyData):
+        return PolyDataSnapshot(polyData, self.quantizationBits)
+
+    def push(self, step):
+        self.undoStack.append(step)
+        self.redoStack = list()
+        self.evict()
+
+    def pushRedo(self, step):
+        self.redoStack.append(step)
+        self.evict()
+
+    def pushUndo(self, step):
+        # Used by redo: does not clear the redo stack
+        self.undoStack.append(step)
+        self.evict()
+
+    def popUndo(self):
+        return self.undoStack.pop() if self.undoStack else None
+
+    def popRedo(self):
+        return self.redoStack.pop() if self.redoStack else None
+
+    def canUndo(self):
+        return len(self.undoStack) > 0
+
+    def canRedo(self):
+        return len(self.redoStack) > 0
+
+    def clear(self):
+        self.undoStack.clear()
+        self.redoStack = list()
+
+    @property
+    def nbytes(self):
+        return sum(step.nbytes for step in self.undoStack) + sum(step.nbytes for step in self.redoStack)
+
+    def evict(self):
+        # Oldest undo steps first, then the redo steps furthest from the current state
+        while self.nbytes > self.byteBudget and len(self.undoStack) > 1:
+            self.undoStack.popleft()
+        while self.nbytes > self.byteBudget and self.redoStack and (self.undoStack or len(self.redoStack) > 1):
+            self.redoStack.pop(0)
@@ -0,0 +1,151 @@
+import collections
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+#
+# Timings and sizes of the stages of the clipping runs
+#
+# Each clipping creates a ClipRun recording, per model, the time of its stages (preparation,
+# clipping, undo snapshot, SetAndObservePolyData, landmarks...) and its triangles and bytes in and
+# out. The profiler keeps the last runs, logs a summary of each one on the "EasyClip" logger and
+# can export them as JSON.
+#
+
+logger = logging.getLogger("EasyClip")
+
+
+def peakMemoryBytes():
+    # Peak resident memory of the process, None if unknown
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def polyDataBytes(polyData):
+    return polyData.GetActualMemorySize() * 1024 if polyData is not None else 0
+
+
+class ClipRun(object):
+    def __init__(self, name):
+        self.name = name
+        self.startTime = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.peakMemoryBefore = peakMemoryBytes()
+        self.peakMemoryAfter = None
+        # The clipping stage is recorded from the worker threads
+        self.lock = threading.Lock()
+        # model key -> {'name':, 'stages': {stage: seconds}, 'trianglesIn':, ...}
+        self.models = collections.OrderedDict()
+        # stage -> seconds, for the stages that are not specific to a model
+        self.stages = collections.OrderedDict()
+
+    def model(self, key, name=None):
+        entry = self.models.get(key)
+        if entry is None:
+            entry = {'name': name or key, 'stages': collections.OrderedDict()}
+            self.models[key] = entry
+        return entry
+
+    def record(self, stage, seconds, key=None):
+        with self.lock:
+            stages = self.stages if key is None else self.model(key)['stages']
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, stage, key=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, key)
+
+    def count(self, key, **counts):
+        # e.g. count(modelID, trianglesIn=..., bytesIn=...), added to the previous counts
+        with self.lock:
+            entry = self.model(key)
+            for name, value in counts.items():
+                entry[name] = entry.get(name, 0) + value
+
+    def finish(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.start
+            self.peakMemoryAfter = peakMemoryBytes()
+
+    def stageTotals(self):
+        totals = collections.OrderedDict(self.stages)
+        for entry in self.models.values():
+            for stage, seconds in entry['stages'].items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def summary(self):
+        trianglesIn = sum(entry.get('trianglesIn', 0) for entry in self.models.values())
+        trianglesOut = sum(entry.get('trianglesOut', 0) for entry in self.models.values())
+        peakIncrease = None
+        if self.peakMemoryBefore is not None and self.peakMemoryAfter is not None:
+            peakIncrease = self.peakMemoryAfter - self.peakMemoryBefore
+        return {'name': self.name,
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.startTime)),
+                'seconds': self.seconds,
+                'models': len(self.models),
+                'trianglesIn': trianglesIn,
+                'trianglesOut': trianglesOut,
+                'bytesIn': sum(entry.get('bytesIn', 0) for entry in self.models.values()),
+                'bytesOut': sum(entry.get('bytesOut', 0) for entry in self.models.values()),
+                'bytesSaved': sum(entry.get('bytesSaved', 0) for entry in self.models.values()),
+                'peakMemoryBytes': self.peakMemoryAfter,
+                'peakMemoryIncreaseBytes': peakIncrease,
+                'stages': self.stageTotals()}
+
+    def toDict(self):
+        dictionary = self.summary()
+        dictionary['perModel'] = self.models
+        return dictionary
+
+
+class ClipProfiler(object):
+    def __init__(self, maxRuns=50):
+        # Last runs, oldest first
+        self.runs = collections.deque(maxlen=maxRuns)
+        # Also time a render of the views after the clipping (slower clipping, but complete timings)
+        self.measureRendering = False
+
+    def startRun(self, name="clipping"):
+        run = ClipRun(name)
+        self.runs.append(run)
+        return run
+
+    def finishRun(self, run):
+        run.finish()
+        summary = run.summary()
+        logger.info("EasyClip: %s of %d models, %d -> %d triangles in %.3fs (%s)",
+                    run.name, summary['models'], summary['trianglesIn'], summary['trianglesOut'], run.seconds,
+                    ", ".join("%s %.3fs" % item for item in summary['stages'].items()))
+        logger.debug("EasyClip run: %s", json.dumps(run.toDict()))
+        return summary
+
+    def lastRun(self):
+        return self.runs[-1] if self.runs else None
+
+    def summaries(self):
+        return [run.summary() for run in self.runs if run.seconds is not None]
+
+    def export(self, filename):
+        with open(filename, 'w') as fileObj:
+            json.dump([run.toDict() for run in self.runs if run.seconds is not None], fileObj, indent=2)
+
+    def clear(self):
+        self.runs.clear()
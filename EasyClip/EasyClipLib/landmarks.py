@@ -0,0 +1,111 @@
+import collections
+import json
+
+#
+# "landmarkDescription" attribute of the fiducial lists
+#
+# The attribute is JSON with single quotes instead of double quotes, as written by the
+# modules sharing it (Q3DC, EasyClip...). It is parsed once per distinct string and the
+# updates are made on the parsed dictionary, only writing the attribute when it changes.
+#
+
+ATTRIBUTE_NAME = "landmarkDescription"
+
+
+class LandmarkDescriptionCodec(object):
+    def __init__(self, cacheSize=4096):
+        self.cacheSize = cacheSize
+        # attribute string -> parsed description, least recently used first
+        self.cache = collections.OrderedDict()
+
+    def remember(self, encoded, description):
+        self.cache[encoded] = description
+        self.cache.move_to_end(encoded)
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    def decode(self, encoded):
+        # The returned dictionary is shared with the cache: use update() to modify it
+        if not encoded:
+            return None
+        description = self.cache.get(encoded)
+        if description is None:
+            description = json.loads(encoded.replace('\'', '\"'))
+            self.remember(encoded, description)
+        else:
+            self.cache.move_to_end(encoded)
+        return description
+
+    def encode(self, description):
+        encoded = json.dumps(description, separators=(',', ':')).replace('\"', '\'')
+        self.remember(encoded, description)
+        return encoded
+
+    def read(self, fidList):
+        return self.decode(fidList.GetAttribute(ATTRIBUTE_NAME))
+
+    def update(self, fidList, function):
+        # function(description) modifies the description in place and returns True if it changed it
+        encoded = fidList.GetAttribute(ATTRIBUTE_NAME)
+        description = self.decode(encoded)
+        if description is None:
+            return False
+        # The cached entry of the old string must not see the modifications
+        del self.cache[encoded]
+        if function(description):
+            fidList.SetAttribute(ATTRIBUTE_NAME, self.encode(description))
+            return True
+        self.remember(encoded, description)
+        return False
+
+    def updateLabels(self, fidList):
+        def setLabels(description):
+            changed = False
+            for n in range(fidList.GetNumberOfMarkups()):
+                landmark = description.get(fidList.GetNthMarkupID(n))
+                markupLabel = fidList.GetNthMarkupLabel(n)
+                if landmark is not None and landmark.get("landmarkLabel") != markupLabel:
+                    landmark["landmarkLabel"] = markupLabel
+                    changed = True
+            return changed
+        return self.update(fidList, setLabels)
+
+    def clearProjections(self, fidList):
+        def unproject(description):
+            for n in range(fidList.GetNumberOfMarkups()):
+                landmark = description.get(fidList.GetNthMarkupID(n))
+                if landmark is None:
+                    continue
+                landmark["projection"]["isProjected"] = False
+                landmark["projection"]["closestPointIndex"] = None
+                landmark["ROIradius"] = 0
+            return True
+        return self.update(fidList, unproject)
+
+    def remapProjections(self, fidList, oldPoints, newPolyData, locator, tolerance=1e-6):
+        # Move the closestPointIndex of the projected landmarks from the original mesh (oldPoints,
+        # (N, 3) array) to the clipped mesh. A landmark stays projected if its point is still in the
+        # clipped mesh, at the same position, and is unprojected if the clipping removed it.
+        def remap(description):
+            for n in range(fidList.GetNumberOfMarkups()):
+                landmark = description.get(fidList.GetNthMarkupID(n))
+                if landmark is None or not landmark.get("projection", {}).get("isProjected"):
+                    continue
+                index = landmark["projection"].get("closestPointIndex")
+                newIndex = -1
+                if index is not None and 0 <= index < len(oldPoints) and newPolyData.GetNumberOfPoints():
+                    point = [float(x) for x in oldPoints[index]]
+                    newIndex = locator.FindClosestPoint(point)
+                    if newIndex >= 0:
+                        newPoint = newPolyData.GetPoint(newIndex)
+                        distance2 = sum((newPoint[axis] - point[axis]) ** 2 for axis in range(3))
+                        if distance2 > tolerance ** 2:
+                            newIndex = -1
+                if newIndex >= 0:
+                    landmark["projection"]["closestPointIndex"] = newIndex
+                else:
+                    landmark["projection"]["isProjected"] = False
+                    landmark["projection"]["closestPointIndex"] = None
+                    landmark["ROIradius"] = 0
+            return True
+        return self.update(fidList, remap)
@@ -0,0 +1,366 @@
+import argparse
+import collections
+import json
+import os
+import socket
+import sys
+import time
+
+from . import batch
+from . import planelibrary
+
+#
+# Batch runs described by a manifest, split in shards and resumable
+#
+# {
+#   "format": "EasyClipManifest",
+#   "version": 1,
+#   "planes": "planes.json",
+#   "sides": {"Red": "neg"},
+#   "options": {"bandLimited": true},
+#   "items": [
+#     {"id": "patient01", "input": "scans/patient01.stl", "preset": "patient01", "output": "clipped/patient01.stl"}
+#   ]
+# }
+#
+# The paths are relative to the manifest. An item without preset uses the preset found for its input
+# in the plane library (see PlaneLibrary.findPresetFor), an item with "sides" overrides the sides of
+# the manifest, which override the sides saved in the preset. "options" are the batch.runBatch options.
+#
+# Each run appends one JSON line per finished item to a checkpoint file: a restarted run skips the
+# items already done, and the checkpoint files of all the shards are merged into one report.
+#
+# Usage (from the EasyClip module directory, with a python that provides vtk):
+#   python -m EasyClipLib.manifest create --planes planes.json --output clipped/ scans/ cohort.json
+#   python -m EasyClipLib.manifest split cohort.json --shards 4
+#   python -m EasyClipLib.manifest run cohort.shard-1-of-4.json
+#   python -m EasyClipLib.manifest merge --report report.json cohort.shard-*.checkpoint.jsonl
+#
+
+FORMAT_NAME = "EasyClipManifest"
+FORMAT_VERSION = 1
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ManifestItem(object):
+    def __init__(self, input, output, preset=None, sides=None, id=None):
+        self.input = input
+        self.output = output
+        self.preset = preset
+        self.sides = sides
+        self.id = id or os.path.splitext(os.path.basename(output))[0]
+
+    def toDict(self):
+        dictionary = collections.OrderedDict([('id', self.id), ('input', self.input), ('output', self.output)])
+        if self.preset is not None:
+            dictionary['preset'] = self.preset
+        if self.sides is not None:
+            dictionary['sides'] = self.sides
+        return dictionary
+
+    @classmethod
+    def fromDict(cls, dictionary):
+        return cls(dictionary['input'], dictionary['output'], dictionary.get('preset'), dictionary.get('sides'),
+                   dictionary.get('id'))
+
+
+class Manifest(object):
+    def __init__(self, items=None, planes=None, sides=None, options=None, directory=''):
+        self.items = list(items or [])
+        # Plane library file
+        self.planes = planes
+        self.sides = sides
+        self.options = options or {}
+        # Directory of the relative paths
+        self.directory = directory
+        duplicates = sorted(id for id, count in collections.Counter(item.id for item in self.items).items()
+                            if count > 1)
+        if duplicates:
+            raise ValueError("Duplicated manifest item ids: %s" % ", ".join(duplicates))
+
+    def path(self, path):
+        return os.path.join(self.directory, path)
+
+    def shard(self, index, count):
+        # Items index, index + count, index + 2 * count... so that the shards get similar mixes of meshes
+        if not 0 <= index < count:
+            raise ValueError("Invalid shard %d of %d" % (index + 1, count))
+        return Manifest(self.items[index::count], self.planes, self.sides, self.options, self.directory)
+
+    def toDict(self):
+        return collections.OrderedDict([('format', FORMAT_NAME), ('version', FORMAT_VERSION),
+                                        ('planes', self.planes), ('sides', self.sides), ('options', self.options),
+                                        ('items', [item.toDict() for item in self.items])])
+
+    @classmethod
+    def fromDict(cls, dictionary, directory=''):
+        if dictionary.get('format') != FORMAT_NAME:
+            raise ValueError("Not an EasyClip manifest")
+        if dictionary.get('version', 0) > FORMAT_VERSION:
+            raise ValueError("Manifest version %s is not supported by this version of EasyClip"
+                             % dictionary['version'])
+        return cls([ManifestItem.fromDict(item) for item in dictionary['items']], dictionary.get('planes'),
+                   dictionary.get('sides'), dictionary.get('options'), directory)
+
+    def save(self, filename):
+        # The paths are written relative to the new manifest
+        directory = os.path.dirname(os.path.abspath(filename))
+
+        def relative(path):
+            return os.path.relpath(os.path.abspath(self.path(path)), directory)
+
+        manifest = Manifest([ManifestItem(relative(item.input), relative(item.output), item.preset, item.sides,
+                                          item.id) for item in self.items],
+                            relative(self.planes) if self.planes else None, self.sides, self.options)
+        temporaryFilename = filename + '.tmp'
+        with open(temporaryFilename, 'w') as fileObj:
+            json.dump(manifest.toDict(), fileObj, indent=1)
+        os.replace(temporaryFilename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fileObj:
+            return cls.fromDict(json.load(fileObj), os.path.dirname(os.path.abspath(filename)))
+
+
+def createManifest(inputs, outputDirectory, planes, preset=None, sides=None, options=None, suffix='',
+                   extension=None):
+    # inputs: as given to batch.collectInputs. Without preset, each item gets the preset found
+    # for its input in the plane library, if any
+    library = planelibrary.PlaneLibrary.load(planes)
+    items = list()
+    for inputPath in batch.collectInputs(inputs):
+        itemPreset = preset
+        if itemPreset is None:
+            found = library.findPresetFor(inputPath)
+            itemPreset = found.name if found is not None else None
+        items.append(ManifestItem(inputPath, batch.outputPathFor(inputPath, outputDirectory, suffix, extension),
+                                  itemPreset))
+    return Manifest(items, planes, sides, options)
+
+
+def shardFilename(filename, index, count, extension='.json'):
+    return "%s.shard-%d-of-%d%s" % (os.path.splitext(filename)[0], index + 1, count, extension)
+
+
+def splitManifest(filename, count):
+    # Writes the count shards next to the manifest, returns their file names
+    manifest = Manifest.load(filename)
+    filenames = list()
+    for index in range(count):
+        shardName = shardFilename(filename, index, count)
+        manifest.shard(index, count).save(shardName)
+        filenames.append(shardName)
+    return filenames
+
+
+def readCheckpoints(filename):
+    # id -> last record of the item. A line cut by a crash is ignored
+    records = collections.OrderedDict()
+    if not os.path.exists(filename):
+        return records
+    with open(filename) as fileObj:
+        for line in fileObj:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['id']] = record
+    return records
+
+
+class CheckpointWriter(object):
+    # Appends one JSON line per finished item, flushed to the disk before the next item
+    def __init__(self, filename):
+        self.fileObj = open(filename, 'a+')
+        # Ends the line cut by a crash, if any, so that the next record is readable
+        if self.fileObj.tell() > 0:
+            self.fileObj.seek(self.fileObj.tell() - 1)
+            if self.fileObj.read(1) != '\n':
+                self.fileObj.write('\n')
+
+    def write(self, record):
+        self.fileObj.write(json.dumps(record) + '\n')
+        self.fileObj.flush()
+        os.fsync(self.fileObj.fileno())
+
+    def close(self):
+        self.fileObj.close()
+
+
+def itemPlanes(manifest, item, libraries):
+    # Planes of an item, None if it has no preset with clipping planes. libraries: cache of the plane libraries
+    if not manifest.planes:
+        return None
+    libraryPath = manifest.path(manifest.planes)
+    if libraryPath not in libraries:
+        libraries[libraryPath] = planelibrary.PlaneLibrary.load(libraryPath)
+    library = libraries[libraryPath]
+    if item.preset is not None:
+        preset = library.presets.get(item.preset)
+    else:
+        preset = library.findPresetFor(manifest.path(item.input))
+    sides = item.sides or manifest.sides
+    if preset is None or not (sides or preset.sides):
+        return None
+    return preset.planes(sides or None)
+
+
+def pendingItems(manifest, checkpoints, retryFailed=False):
+    # Items not done yet, or done but whose output is missing
+    pending = list()
+    for item in manifest.items:
+        record = checkpoints.get(item.id)
+        if record is None or (record['status'] == FAILED and retryFailed):
+            pending.append(item)
+        elif record['status'] == DONE and not os.path.exists(manifest.path(item.output)):
+            pending.append(item)
+    return pending
+
+
+def runManifest(manifest, checkpointFilename, processes=None, callback=None, retryFailed=False, shard=None):
+    # Clips the pending items of the manifest and appends their records to the checkpoint file.
+    # shard: (index, count) written in the records. Returns the records of this run
+    checkpoints = readCheckpoints(checkpointFilename)
+    items = pendingItems(manifest, checkpoints, retryFailed)
+    libraries = dict()
+    jobs = list()
+    ids = dict()
+    for item in items:
+        outputPath = manifest.path(item.output)
+        outputDirectory = os.path.dirname(outputPath)
+        if outputDirectory and not os.path.isdir(outputDirectory):
+            os.makedirs(outputDirectory)
+        jobs.append((manifest.path(item.input), outputPath, itemPlanes(manifest, item, libraries),
+                     manifest.options, None))
+        ids[outputPath] = item.id
+    host = socket.gethostname()
+    records = list()
+    writer = CheckpointWriter(checkpointFilename)
+
+    def onResult(result):
+        record = collections.OrderedDict([('id', ids[result['output']])])
+        record.update(result)
+        record['host'] = host
+        record['shard'] = list(shard) if shard else None
+        record['finished'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        writer.write(record)
+        records.append(record)
+        if callback:
+            callback(record)
+
+    try:
+        batch.runJobs(jobs, processes, onResult)
+    finally:
+        writer.close()
+    return records
+
+
+def mergeReports(checkpointFilenames):
+    # Last record of each item over all the checkpoint files, and totals
+    records = collections.OrderedDict()
+    for filename in checkpointFilenames:
+        records.update(readCheckpoints(filename))
+    records = list(records.values())
+    done = [record for record in records if record['status'] == DONE]
+    summary = {'items': len(records),
+               'done': len(done),
+               'failed': len(records) - len(done),
+               'seconds': sum(record.get('seconds', 0) for record in records),
+               'cellsIn': sum(record.get('cellsIn', 0) for record in done),
+               'cellsOut': sum(record.get('cellsOut', 0) for record in done),
+               'hosts': sorted(set(record['host'] for record in records if record.get('host')))}
+    return {'summary': summary, 'items': records}
+
+
+def parseShard(value):
+    # "2/4" -> (1, 4)
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid shard '%s', expected e.g. 2/4" % value)
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("Invalid shard '%s', expected e.g. 2/4" % value)
+    return index - 1, count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumable and sharded EasyClip batch runs.")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    create = commands.add_parser('create', help="write a manifest of meshes to clip")
+    create.add_argument('inputs', nargs='+', help="meshes, directories of meshes or text manifests")
+    create.add_argument('manifest', help="manifest to write")
+    create.add_argument('--planes', required=True, help="plane library saved with 'Save planes'")
+    create.add_argument('--preset', default=None, help="preset used for all the meshes (default: found per mesh)")
+    create.add_argument('--plane', action='append', default=[], metavar='COLOR:SIDE',
+                        help="plane to clip with and side to keep (neg/pos), e.g. Red:neg. Repeatable. "
+                             "Default: the planes saved in the presets.")
+    create.add_argument('--output', required=True, help="output directory")
+    create.add_argument('--suffix', default='', help="suffix added to the output file names")
+    create.add_argument('--format', choices=[e[1:] for e in batch.engine.MESH_EXTENSIONS], default=None,
+                        help="output format (default: same as input)")
+    create.add_argument('--band', action='store_true', help="only run the clipper on the cells near the planes")
+
+    split = commands.add_parser('split', help="split a manifest in shards, written next to it")
+    split.add_argument('manifest')
+    split.add_argument('--shards', type=int, required=True)
+
+    run = commands.add_parser('run', help="clip the items of a manifest not done yet")
+    run.add_argument('manifest')
+    run.add_argument('--shard', type=parseShard, default=None, metavar='I/N',
+                     help="only run the shard I of N of the manifest")
+    run.add_argument('--checkpoint', default=None,
+                     help="checkpoint file (default: next to the manifest, .checkpoint.jsonl)")
+    run.add_argument('--processes', type=int, default=None, help="worker processes (default: all cores)")
+    run.add_argument('--retry-failed', action='store_true', help="also clip again the items that failed")
+
+    merge = commands.add_parser('merge', help="merge the checkpoint files of the shards in one report")
+    merge.add_argument('checkpoints', nargs='+')
+    merge.add_argument('--report', required=True, help="JSON report to write")
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        try:
+            sides = batch.parsePlaneSides(args.plane) or None
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+        extension = '.' + args.format if args.format else None
+        manifest = createManifest(args.inputs, args.output, args.planes, args.preset, sides,
+                                  {'bandLimited': args.band}, args.suffix, extension)
+        manifest.save(args.manifest)
+        withoutPreset = [item for item in manifest.items if item.preset is None]
+        print("%d items written, %d without preset" % (len(manifest.items), len(withoutPreset)))
+    elif args.command == 'split':
+        for filename in splitManifest(args.manifest, args.shards):
+            print(filename)
+    elif args.command == 'run':
+        manifest = Manifest.load(args.manifest)
+        if args.shard is not None:
+            manifest = manifest.shard(*args.shard)
+            defaultCheckpoint = shardFilename(args.manifest, args.shard[0], args.shard[1], '.checkpoint.jsonl')
+        else:
+            defaultCheckpoint = os.path.splitext(args.manifest)[0] + '.checkpoint.jsonl'
+        checkpoint = args.checkpoint or defaultCheckpoint
+        start = time.time()
+        records = runManifest(manifest, checkpoint, args.processes, batch.printResult, args.retry_failed,
+                              args.shard)
+        failed = [record for record in records if record['status'] == FAILED]
+        print("%d meshes clipped, %d failed, %d skipped in %.1fs" % (
+            len(records) - len(failed), len(failed), len(manifest.items) - len(records), time.time() - start))
+        return 1 if failed else 0
+    else:
+        report = mergeReports(args.checkpoints)
+        with open(args.report, 'w') as reportFile:
+            json.dump(report, reportFile, indent=2)
+        summary = report['summary']
+        print("%d items: %d done, %d failed, %.1fs of clipping on %d hosts" % (
+            summary['items'], summary['done'], summary['failed'], summary['seconds'], len(summary['hosts'])))
+        return 1 if summary['failed'] else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
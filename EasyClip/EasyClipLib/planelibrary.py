@@ -0,0 +1,130 @@
+import collections
+import gzip
+import io
+import json
+import os
+import pickle
+
+from . import engine
+
+#
+# Plane library: many named plane presets in one versioned JSON file (gzipped if the name ends with .gz)
+#
+# {
+#   "format": "EasyClipPlaneLibrary",
+#   "version": 1,
+#   "presets": {
+#     "patient01": {
+#       "matrices": {"Red": 4x4 SliceToRAS matrix, "Yellow": ..., "Green": ...},
+#       "sides": {"Red": "neg", "Green": "pos"},
+#       "metadata": {"patientID": "patient01", "template": "mandible"}
+#     }
+#   }
+# }
+#
+# The files written by the previous versions of the module (a pickled dictionary of the three
+# matrices) are still read, without allowing the pickle to create any object.
+#
+
+FORMAT_NAME = "EasyClipPlaneLibrary"
+FORMAT_VERSION = 1
+
+
+class PlanePreset(object):
+    def __init__(self, name, matrices, sides=None, metadata=None):
+        self.name = name
+        # color -> 4x4 SliceToRAS matrix (nested lists)
+        self.matrices = matrices
+        # color -> 'neg' or 'pos', for the planes used to clip
+        self.sides = sides or {}
+        self.metadata = metadata or {}
+
+    def planes(self, sides=None):
+        return engine.planesFromMatrices(self.matrices, sides if sides is not None else self.sides)
+
+    def toDict(self):
+        return {'matrices': self.matrices, 'sides': self.sides, 'metadata': self.metadata}
+
+    @classmethod
+    def fromDict(cls, name, dictionary):
+        return cls(name, dictionary['matrices'], dictionary.get('sides'), dictionary.get('metadata'))
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    # The legacy files only contain dictionaries, lists, strings and floats
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("Plane files cannot contain objects (%s.%s)" % (module, name))
+
+
+def readLegacyPlaneFile(filename):
+    with open(filename, 'rb') as fileObj:
+        return LegacyUnpickler(fileObj).load()
+
+
+class PlaneLibrary(object):
+    def __init__(self, presets=None):
+        # name -> PlanePreset
+        self.presets = collections.OrderedDict()
+        for preset in presets or []:
+            self.addPreset(preset)
+
+    def addPreset(self, preset):
+        self.presets[preset.name] = preset
+
+    def removePreset(self, name):
+        del self.presets[name]
+
+    def getPreset(self, name):
+        if name not in self.presets:
+            raise KeyError("No plane preset named '%s'" % name)
+        return self.presets[name]
+
+    def names(self):
+        return list(self.presets)
+
+    def findPresets(self, **metadata):
+        # Presets whose metadata has all the given values, e.g. findPresets(patientID="patient01")
+        return [preset for preset in self.presets.values()
+                if all(preset.metadata.get(key) == value for key, value in metadata.items())]
+
+    def findPresetFor(self, filename):
+        # Preset named like the file, or with the file name as patientID
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        if stem in self.presets:
+            return self.presets[stem]
+        presets = self.findPresets(patientID=stem)
+        return presets[0] if presets else None
+
+    def toDict(self):
+        return {'format': FORMAT_NAME,
+                'version': FORMAT_VERSION,
+                'presets': collections.OrderedDict((name, preset.toDict()) for name, preset in self.presets.items())}
+
+    @classmethod
+    def fromDict(cls, dictionary):
+        if dictionary.get('format') != FORMAT_NAME:
+            raise ValueError("Not an EasyClip plane library")
+        if dictionary.get('version', 0) > FORMAT_VERSION:
+            raise ValueError("Plane library version %s is not supported" % dictionary.get('version'))
+        return cls([PlanePreset.fromDict(name, preset) for name, preset in dictionary['presets'].items()])
+
+    def save(self, filename):
+        # Written next to the destination first, so an interrupted save keeps the previous library
+        temporaryFilename = filename + '.tmp'
+        opener = gzip.open if filename.endswith('.gz') else io.open
+        with opener(temporaryFilename, 'wt') as fileObj:
+            json.dump(self.toDict(), fileObj, indent=1)
+        os.replace(temporaryFilename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        opener = gzip.open if filename.endswith('.gz') else io.open
+        try:
+            with opener(filename, 'rt') as fileObj:
+                dictionary = json.load(fileObj)
+        except (ValueError, UnicodeDecodeError):
+            # Plane file of the previous versions: one preset named after the file
+            matrices = readLegacyPlaneFile(filename)
+            name = os.path.splitext(os.path.basename(filename))[0]
+            return cls([PlanePreset(name, matrices)])
+        return cls.fromDict(dictionary)
@@ -0,0 +1,92 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# numpy views and builders for triangle meshes
+#
+
+# numpy type of the vtkIdType arrays (numpy_support.ID_TYPE_CODE is gone from recent VTK)
+ID_TYPE = numpy_support.get_vtk_to_numpy_typemap()[vtk.VTK_ID_TYPE]
+
+
+def pointsAsArray(polyData):
+    return numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+
+
+def trianglesAsArray(polyData):
+    # (N, 3) array of point ids, or None if the mesh is not only made of triangles
+    polys = polyData.GetPolys()
+    numberOfCells = polys.GetNumberOfCells()
+    if numberOfCells == 0 or numberOfCells != polyData.GetNumberOfCells():
+        return None
+    if hasattr(polys, 'GetConnectivityArray'):
+        # VTK 9: view on the storage of the cell array. GetData() would export the legacy
+        # format to a buffer that the next GetData() call overwrites
+        offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+        if (numpy.diff(offsets) != 3).any():
+            return None
+        return numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3)
+    legacy = numpy_support.vtk_to_numpy(polys.GetData())
+    if legacy.size != 4 * numberOfCells:
+        return None
+    legacy = legacy.reshape(-1, 4)
+    if (legacy[:, 0] != 3).any():
+        return None
+    return legacy[:, 1:]
+
+
+def cellArrayFromTriangles(triangles):
+    cells = numpy.empty((len(triangles), 4), dtype=ID_TYPE)
+    cells[:, 0] = 3
+    cells[:, 1:] = triangles
+    cellArray = vtk.vtkCellArray()
+    cellArray.SetCells(len(triangles), numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=1))
+    return cellArray
+
+
+def copyArrays(source, target, ids=None):
+    # Copy the numeric arrays of a vtkDataSetAttributes, restricted to ids if given
+    for index in range(source.GetNumberOfArrays()):
+        array = source.GetArray(index)
+        if array is None or not array.GetName():
+            continue
+        values = numpy_support.vtk_to_numpy(array)
+        if ids is not None:
+            values = values[ids]
+        newArray = numpy_support.numpy_to_vtk(values, deep=1, array_type=array.GetDataType())
+        newArray.SetName(array.GetName())
+        target.AddArray(newArray)
+    for attribute, setter in ((source.GetScalars(), target.SetActiveScalars),
+                              (source.GetNormals(), target.SetActiveNormals),
+                              (source.GetTCoords(), target.SetActiveTCoords)):
+        if attribute is not None and attribute.GetName() and target.HasArray(attribute.GetName()):
+            setter(attribute.GetName())
+
+
+def polyDataFromArrays(points, triangles):
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(numpy.ascontiguousarray(points), deep=1))
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(vtkPoints)
+    polyData.SetPolys(cellArrayFromTriangles(triangles))
+    return polyData
+
+
+def extractTriangles(polyData, triangles):
+    # New mesh made of the given triangles and only the points they use.
+    # Returns the mesh and the ids of its points in polyData
+    pointIds, localTriangles = numpy.unique(triangles, return_inverse=True)
+    output = polyDataFromArrays(pointsAsArray(polyData)[pointIds], localTriangles.reshape(-1, 3))
+    copyArrays(polyData.GetPointData(), output.GetPointData(), pointIds)
+    return output, pointIds
+
+
+def buildPointLocator(polyData):
+    if hasattr(vtk, 'vtkStaticPointLocator'):
+        locator = vtk.vtkStaticPointLocator()
+    else:
+        locator = vtk.vtkPointLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+    return locator
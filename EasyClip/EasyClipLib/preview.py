@@ -0,0 +1,42 @@
+import vtk
+
+#
+# Decimated proxies of the models, clipped at interactive rates while the planes move
+#
+
+
+def decimatePolyData(polyData, targetTriangles):
+    numberOfPolys = polyData.GetNumberOfPolys()
+    if numberOfPolys <= targetTriangles:
+        return polyData
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(polyData)
+    decimation = vtk.vtkQuadricDecimation()
+    decimation.SetInputConnection(triangleFilter.GetOutputPort())
+    decimation.SetTargetReduction(1.0 - float(targetTriangles) / numberOfPolys)
+    decimation.Update()
+    proxy = vtk.vtkPolyData()
+    proxy.ShallowCopy(decimation.GetOutput())
+    return proxy
+
+
+class ProxyCache(object):
+    # One proxy per model, rebuilt only when the polydata of the model changes
+    def __init__(self, targetTriangles=20000):
+        self.targetTriangles = targetTriangles
+        # key -> (polydata MTime, proxy)
+        self.proxies = dict()
+
+    def getProxy(self, key, polyData):
+        cached = self.proxies.get(key)
+        if cached is not None and cached[0] == polyData.GetMTime():
+            return cached[1]
+        proxy = decimatePolyData(polyData, self.targetTriangles)
+        self.proxies[key] = (polyData.GetMTime(), proxy)
+        return proxy
+
+    def remove(self, key):
+        self.proxies.pop(key, None)
+
+    def clear(self):
+        self.proxies = dict()
@@ -0,0 +1,55 @@
+#
+# Temporary helper nodes
+#
+
+
+class TemporaryNodePool(object):
+    # Hidden helper nodes (preview models, segmentation label maps...) created by EasyClip.
+    # A node is created once per key and reused afterwards; clear() removes all the nodes from the scene.
+    def __init__(self, scene):
+        self.scene = scene
+        # key -> node ID
+        self.nodes = dict()
+
+    def acquire(self, className, key):
+        nodeID = self.nodes.get(key)
+        node = self.scene.GetNodeByID(nodeID) if nodeID else None
+        if node is None or not node.IsA(className):
+            node = self.scene.CreateNodeByClass(className)
+            node.UnRegister(None)
+            node.HideFromEditorsOn()
+            node.SetSaveWithScene(False)
+            self.scene.AddNode(node)
+            self.nodes[key] = node.GetID()
+        return node
+
+    def get(self, key):
+        nodeID = self.nodes.get(key)
+        return self.scene.GetNodeByID(nodeID) if nodeID else None
+
+    def remove(self, key):
+        node = self.get(key)
+        if node is not None:
+            self.scene.RemoveNode(node)
+        self.nodes.pop(key, None)
+
+    def clear(self):
+        for key in list(self.nodes):
+            self.remove(key)
+
+    def forget(self):
+        # The scene has been closed: the nodes are already gone
+        self.nodes = dict()
+
+    def keys(self):
+        return list(self.nodes)
+
+    @property
+    def nbytes(self):
+        total = 0
+        for key in self.nodes:
+            node = self.get(key)
+            if node is not None and node.IsA("vtkMRMLModelNode") and node.GetPolyData() is not None:
+                # GetActualMemorySize is in kibibytes
+                total += node.GetPolyData().GetActualMemorySize() * 1024
+        return total
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# Clipped meshes kept on disk, named by the hash of everything the result depends on
+#
+# A repeated clip of the same mesh with the same planes and options reads the result back
+# instead of running the clipper. The files are compressed .vtp, the least recently used
+# ones are removed when the directory grows over maxBytes. The directory can be shared by
+# several processes (batch workers): the files are written atomically and never modified.
+#
+
+# Changed when the clipping gives different results for the same inputs
+CACHE_VERSION = 1
+EXTENSION = '.vtp'
+# Plane coordinates are rounded so that a plane read back from a file gives the same key
+PLANE_DECIMALS = 6
+
+
+def hashVTKArray(sha, array):
+    if array is None:
+        sha.update(b'-')
+        return
+    sha.update(("%s:%s:%d:%d" % (array.GetName(), array.GetDataTypeAsString(), array.GetNumberOfTuples(),
+                                 array.GetNumberOfComponents())).encode('utf-8'))
+    if array.IsNumeric():
+        sha.update(numpy.ascontiguousarray(numpy_support.vtk_to_numpy(array)).data)
+
+
+def hashPolyData(sha, polyData):
+    points = polyData.GetPoints()
+    hashVTKArray(sha, points.GetData() if points is not None else None)
+    for cells in (polyData.GetVerts(), polyData.GetLines(), polyData.GetPolys(), polyData.GetStrips()):
+        hashVTKArray(sha, cells.GetData())
+    for attributes in (polyData.GetPointData(), polyData.GetCellData()):
+        for index in range(attributes.GetNumberOfArrays()):
+            hashVTKArray(sha, attributes.GetArray(index))
+
+
+def resultKey(polyData, planes, options=None):
+    sha = hashlib.sha1()
+    sha.update(("EasyClip%d" % CACHE_VERSION).encode('utf-8'))
+    hashPolyData(sha, polyData)
+    roundedPlanes = [[[round(float(x), PLANE_DECIMALS) for x in vector[:3]] for vector in plane] for plane in planes]
+    sha.update(json.dumps(roundedPlanes).encode('utf-8'))
+    sha.update(json.dumps(sorted((options or {}).items())).encode('utf-8'))
+    return sha.hexdigest()
+
+
+class ClipResultCache(object):
+    def __init__(self, directory, maxBytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Several worker processes may create it at the same time
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def get(self, key):
+        filename = self.path(key)
+        if not os.path.isfile(filename):
+            self.misses += 1
+            return None
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(filename)
+        reader.Update()
+        if reader.GetErrorCode():
+            # Truncated or removed by another process meanwhile
+            self.misses += 1
+            return None
+        try:
+            # The modification time orders the files for the eviction
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.hits += 1
+        polyData = vtk.vtkPolyData()
+        polyData.ShallowCopy(reader.GetOutput())
+        return polyData
+
+    def put(self, key, polyData):
+        filename = self.path(key)
+        temporaryFilename = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.current_thread().ident)
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetFileName(temporaryFilename)
+        writer.SetInputData(polyData)
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()
+        writer.SetCompressorTypeToZLib()
+        if not writer.Write():
+            if os.path.exists(temporaryFilename):
+                os.remove(temporaryFilename)
+            return False
+        os.replace(temporaryFilename, filename)
+        self.evict()
+        return True
+
+    def entries(self):
+        # (mtime, size, path) of the cached files, least recently used first
+        entries = list()
+        for name in os.listdir(self.directory):
+            if not name.endswith(EXTENSION):
+                continue
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        entries.sort()
+        return entries
+
+    def nbytes(self):
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        with self.lock:
+            entries = self.entries()
+            total = sum(entry[1] for entry in entries)
+            for mtime, size, filename in entries:
+                if total <= self.maxBytes:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        with self.lock:
+            for mtime, size, filename in self.entries():
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def clipPolyData(self, clipFunction, polyData, planes, **options):
+        # clipFunction(polyData, planes, **options) only runs if the result is not cached.
+        # The progress and abort arguments are not part of the key
+        keyOptions = dict((name, value) for name, value in options.items()
+                          if name not in ('progressCallback', 'abortEvent'))
+        key = resultKey(polyData, planes, keyOptions)
+        polyDataNew = self.get(key)
+        if polyDataNew is not None:
+            return polyDataNew
+        polyDataNew = clipFunction(polyData, planes, **options)
+        abortEvent = options.get('abortEvent')
+        # An unchanged mesh is not worth a file, and an aborted clip is incomplete
+        if polyDataNew is not polyData and not (abortEvent is not None and abortEvent.is_set()):
+            self.put(key, polyDataNew)
+        return polyDataNew
@@ -0,0 +1,195 @@
+import collections
+
+import vtk
+
+#
+# Indexes of the scene nodes used by EasyClip, kept current by observers
+# so that the clipping does not have to rescan the scene
+#
+
+
+class FiducialListIndex(object):
+    # model ID -> fiducial lists connected to it (through their "connectedModelID" attribute)
+    def __init__(self, scene, className="vtkMRMLMarkupsFiducialNode"):
+        self.scene = scene
+        self.className = className
+        # model ID -> set of fiducial list IDs
+        self.modelToLists = dict()
+        # fiducial list ID -> model ID (or None)
+        self.listToModel = dict()
+        # fiducial list ID -> (node, observer tag)
+        self.nodeObservers = dict()
+        self.sceneObservers = [
+            scene.AddObserver(scene.NodeAddedEvent, self.onNodeAdded),
+            scene.AddObserver(scene.NodeRemovedEvent, self.onNodeRemoved),
+            scene.AddObserver(scene.EndCloseEvent, self.onSceneClosed),
+        ]
+        self.rebuild()
+
+    def rebuild(self):
+        self.removeNodeObservers()
+        self.modelToLists = dict()
+        self.listToModel = dict()
+        collection = self.scene.GetNodesByClass(self.className)
+        for i in range(collection.GetNumberOfItems()):
+            self.addList(collection.GetItemAsObject(i))
+
+    def addList(self, fidList):
+        tag = fidList.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onListModified)
+        self.nodeObservers[fidList.GetID()] = (fidList, tag)
+        self.listToModel[fidList.GetID()] = None
+        self.updateList(fidList)
+
+    def removeList(self, fidListID):
+        if fidListID in self.nodeObservers:
+            fidList, tag = self.nodeObservers.pop(fidListID)
+            fidList.RemoveObserver(tag)
+        modelID = self.listToModel.pop(fidListID, None)
+        if modelID is not None:
+            self.modelToLists[modelID].discard(fidListID)
+
+    def updateList(self, fidList):
+        fidListID = fidList.GetID()
+        modelID = fidList.GetAttribute("connectedModelID") or None
+        previousModelID = self.listToModel.get(fidListID)
+        if modelID == previousModelID:
+            return
+        if previousModelID is not None:
+            self.modelToLists[previousModelID].discard(fidListID)
+        if modelID is not None:
+            self.modelToLists.setdefault(modelID, set()).add(fidListID)
+        self.listToModel[fidListID] = modelID
+
+    def getConnectedLists(self, modelID):
+        fidLists = list()
+        for fidListID in sorted(self.modelToLists.get(modelID, ())):
+            fidList = self.nodeObservers[fidListID][0]
+            fidLists.append(fidList)
+        return fidLists
+
+    def getAllLists(self):
+        return [self.nodeObservers[fidListID][0] for fidListID in sorted(self.nodeObservers)]
+
+    def onListModified(self, caller, event):
+        self.updateList(caller)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def onNodeAdded(self, caller, event, callData):
+        if callData.IsA(self.className) and callData.GetID() not in self.nodeObservers:
+            self.addList(callData)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def onNodeRemoved(self, caller, event, callData):
+        if callData.IsA(self.className):
+            self.removeList(callData.GetID())
+
+    def onSceneClosed(self, caller, event):
+        self.rebuild()
+
+    def removeNodeObservers(self):
+        for fidList, tag in self.nodeObservers.values():
+            fidList.RemoveObserver(tag)
+        self.nodeObservers = dict()
+
+    def stop(self):
+        self.removeNodeObservers()
+        for tag in self.sceneObservers:
+            self.scene.RemoveObserver(tag)
+        self.sceneObservers = list()
+
+
+# Models that are never clipped nor bounded: the slice models of the views, the nodes hidden
+# from the editors (EasyClip's own temporary nodes) and the models with this attribute set to "1"
+SLICE_MODEL_NAMES = ('Red Volume Slice', 'Yellow Volume Slice', 'Green Volume Slice')
+IGNORE_ATTRIBUTE = "EasyClip.Ignore"
+
+
+class ModelEntry(object):
+    def __init__(self, node):
+        self.node = node
+        self.visible = False
+        self.ignored = False
+        self.transformNodeID = None
+        # observer tags on the node
+        self.tags = list()
+
+
+class ModelRegistry(object):
+    # Model nodes of the scene in scene order, with their visibility, ignore flag and transform
+    # kept current by observers, so that listing the models does not scan the scene
+    def __init__(self, scene, className="vtkMRMLModelNode"):
+        self.scene = scene
+        self.className = className
+        # model ID -> ModelEntry, in the order the models were added to the scene
+        self.entries = collections.OrderedDict()
+        self.sceneObservers = [
+            scene.AddObserver(scene.NodeAddedEvent, self.onNodeAdded),
+            scene.AddObserver(scene.NodeRemovedEvent, self.onNodeRemoved),
+            scene.AddObserver(scene.EndCloseEvent, self.onSceneClosed),
+        ]
+        self.rebuild()
+
+    def rebuild(self):
+        self.removeNodeObservers()
+        collection = self.scene.GetNodesByClass(self.className)
+        for i in range(collection.GetNumberOfItems()):
+            self.addModel(collection.GetItemAsObject(i))
+
+    def addModel(self, model):
+        entry = ModelEntry(model)
+        entry.tags = [model.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onModelModified),
+                      model.AddObserver(model.DisplayModifiedEvent, self.onModelModified),
+                      model.AddObserver(model.TransformModifiedEvent, self.onModelModified)]
+        self.entries[model.GetID()] = entry
+        self.updateModel(model)
+
+    def removeModel(self, modelID):
+        entry = self.entries.pop(modelID, None)
+        if entry is not None:
+            for tag in entry.tags:
+                entry.node.RemoveObserver(tag)
+
+    def updateModel(self, model):
+        entry = self.entries.get(model.GetID())
+        if entry is None:
+            return
+        entry.visible = bool(model.GetDisplayVisibility())
+        entry.ignored = (model.GetName() in SLICE_MODEL_NAMES or bool(model.GetHideFromEditors())
+                         or model.GetAttribute(IGNORE_ATTRIBUTE) == "1")
+        entry.transformNodeID = model.GetTransformNodeID()
+
+    def getModels(self, visibleOnly=False, includeIgnored=False):
+        return [entry.node for entry in self.entries.values()
+                if (includeIgnored or not entry.ignored) and (entry.visible or not visibleOnly)]
+
+    def getVisibleModels(self):
+        return self.getModels(visibleOnly=True)
+
+    def getEntry(self, modelID):
+        return self.entries.get(modelID)
+
+    def onModelModified(self, caller, event):
+        self.updateModel(caller)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def onNodeAdded(self, caller, event, callData):
+        if callData.IsA(self.className) and callData.GetID() not in self.entries:
+            self.addModel(callData)
+
+    @vtk.calldata_type(vtk.VTK_OBJECT)
+    def onNodeRemoved(self, caller, event, callData):
+        if callData.IsA(self.className):
+            self.removeModel(callData.GetID())
+
+    def onSceneClosed(self, caller, event):
+        self.rebuild()
+
+    def removeNodeObservers(self):
+        for modelID in list(self.entries):
+            self.removeModel(modelID)
+
+    def stop(self):
+        self.removeNodeObservers()
+        for tag in self.sceneObservers:
+            self.scene.RemoveObserver(tag)
+        self.sceneObservers = list()
@@ -0,0 +1,199 @@
+import os
+
+import numpy
+import vtk
+
+from . import engine
+from . import instrumentation
+from . import polydata
+
+#
+# Out-of-core clipping of binary STL files
+#
+# A mesh larger than the memory is never loaded: the input STL is memory mapped and read by
+# chunks of triangles. Only the band of triangles touching a plane (plus a ring of neighbours)
+# goes through vtkClipClosedSurface, as in engine.clipPolyDataBand. The caps only depend on the cut
+# contours, which all lie in the band, so the untouched triangles are written to the output as they
+# are read and the clipped band is appended at the end: the output is the same closed surface.
+#
+# memoryLimit bounds the memory used by the chunks and by the clipping of the band. A band that
+# cannot be clipped within the limit raises a MemoryError before VTK allocates anything.
+#
+
+STL_HEADER_BYTES = 80
+STL_RECORD = numpy.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+# Rough memory used per triangle of a chunk: the record, its vertices in double precision,
+# the distances to a plane and the masks
+CHUNK_BYTES_PER_TRIANGLE = STL_RECORD.itemsize + 9 * 8 + 64
+CHUNK_BYTES_PER_PLANE = 3 * 8
+# Rough memory used per triangle of the band by vtkClipClosedSurface, its input and its output
+BAND_BYTES_PER_TRIANGLE = 1024
+# Share of the memory limit used by the chunks, the rest is left to the band
+CHUNK_SHARE = 0.25
+MIN_CHUNK_TRIANGLES = 4096
+DEFAULT_MEMORY_LIMIT = 1024 ** 3
+
+
+def numberOfStlTriangles(filename):
+    # Number of triangles of a binary STL, ValueError for an ASCII STL
+    size = os.path.getsize(filename)
+    if size < STL_HEADER_BYTES + 4:
+        raise ValueError("%s is not a binary STL file" % filename)
+    with open(filename, 'rb') as stlFile:
+        stlFile.seek(STL_HEADER_BYTES)
+        count = int(numpy.frombuffer(stlFile.read(4), dtype='<u4')[0])
+    if STL_HEADER_BYTES + 4 + count * STL_RECORD.itemsize > size:
+        raise ValueError("%s is not a binary STL file" % filename)
+    return count
+
+
+def mapStl(filename):
+    count = numberOfStlTriangles(filename)
+    if count == 0:
+        return numpy.zeros(0, dtype=STL_RECORD)
+    return numpy.memmap(filename, dtype=STL_RECORD, mode='r', offset=STL_HEADER_BYTES + 4, shape=(count,))
+
+
+def chunkSizeFor(memoryLimit, numberOfPlanes):
+    bytesPerTriangle = CHUNK_BYTES_PER_TRIANGLE + numberOfPlanes * CHUNK_BYTES_PER_PLANE
+    return max(MIN_CHUNK_TRIANGLES, int(memoryLimit * CHUNK_SHARE) // bytesPerTriangle)
+
+
+def classifyTriangles(vertices, planes):
+    # vertices: (N, 3, 3). Returns the (removed, crossed) masks of the triangles, as in
+    # engine.clipPolyDataBand: removed if on the removed side of a plane, crossed if touching a plane
+    removed = numpy.zeros(len(vertices), dtype=bool)
+    crossed = numpy.zeros(len(vertices), dtype=bool)
+    for origin, normal in planes:
+        distances = numpy.dot(vertices - numpy.asarray(origin, dtype=float)[:3], numpy.asarray(normal, dtype=float)[:3])
+        removed |= distances.max(axis=1) < 0
+        crossed |= distances.min(axis=1) <= 0
+    return removed, crossed & ~removed
+
+
+def vertexKeys(vertices):
+    # One 64 bit key per vertex from the bits of its float32 coordinates. A collision only adds a
+    # triangle to the band, where the clipper leaves it unchanged
+    bits = numpy.ascontiguousarray(vertices, dtype='<f4').view('<u4').reshape(-1, 3).astype(numpy.uint64)
+    return (bits[:, 0] * numpy.uint64(0x9E3779B97F4A7C15)) ^ (bits[:, 1] * numpy.uint64(0xC2B2AE3D27D4EB4F)) \
+        ^ (bits[:, 2] * numpy.uint64(0x165667B19E3779F9))
+
+
+class StlWriter(object):
+    # Binary STL written record by record, the number of triangles is set on close
+    def __init__(self, filename):
+        self.fileObj = open(filename, 'wb')
+        self.fileObj.write(b'EasyClip'.ljust(STL_HEADER_BYTES, b' '))
+        self.fileObj.write(numpy.zeros(1, dtype='<u4').tobytes())
+        self.count = 0
+
+    def writeRecords(self, records):
+        self.fileObj.write(numpy.ascontiguousarray(records, dtype=STL_RECORD).tobytes())
+        self.count += len(records)
+
+    def writeTriangles(self, vertices):
+        # vertices: (N, 3, 3)
+        records = numpy.zeros(len(vertices), dtype=STL_RECORD)
+        records['vertices'] = vertices
+        normals = numpy.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+        lengths = numpy.linalg.norm(normals, axis=1)
+        lengths[lengths == 0] = 1
+        records['normal'] = normals / lengths[:, numpy.newaxis]
+        self.writeRecords(records)
+
+    def close(self):
+        self.fileObj.seek(STL_HEADER_BYTES)
+        self.fileObj.write(numpy.array([self.count], dtype='<u4').tobytes())
+        self.fileObj.close()
+
+
+def bandPolyData(vertices):
+    # Triangle soup (N, 3, 3) to a mesh with its coincident points merged, so that the clipper
+    # sees connected contours
+    points, triangles = numpy.unique(vertices.reshape(-1, 3), axis=0, return_inverse=True)
+    return polydata.polyDataFromArrays(points.astype(numpy.float64), triangles.reshape(-1, 3))
+
+
+def clipStlFile(inputPath, outputPath, planes, memoryLimit=DEFAULT_MEMORY_LIMIT, ring=True, progressCallback=None):
+    # Clips a binary STL file into a binary STL file. ring: also clip the triangles sharing a vertex
+    # with the band, as engine.clipPolyDataBand does. progressCallback(fraction).
+    # Returns the statistics of the run, with the working memory estimated from the arrays in use
+    # and the peak memory of the process
+    records = mapStl(inputPath)
+    chunkSize = chunkSizeFor(memoryLimit, len(planes))
+    chunks = range(0, len(records), chunkSize)
+    stats = {'trianglesIn': len(records), 'memoryLimit': memoryLimit, 'chunkTriangles': chunkSize,
+             'chunks': len(chunks)}
+    workingBytes = 0
+
+    def report(fraction):
+        if progressCallback is not None:
+            progressCallback(fraction)
+
+    # First pass: keys of the vertices of the triangles crossed by a plane
+    bandKeys = list()
+    numberOfBandVertices = 0
+    for index, start in enumerate(chunks):
+        vertices = records['vertices'][start:start + chunkSize].astype(numpy.float64)
+        removed, crossed = classifyTriangles(vertices, planes)
+        keys = numpy.unique(vertexKeys(vertices[crossed]))
+        bandKeys.append(keys)
+        numberOfBandVertices += len(keys)
+        workingBytes = max(workingBytes, len(vertices) * CHUNK_BYTES_PER_TRIANGLE + numberOfBandVertices * 8)
+        report(0.25 * (index + 1) / len(chunks))
+    bandKeys = numpy.unique(numpy.concatenate(bandKeys)) if bandKeys else numpy.zeros(0, dtype=numpy.uint64)
+    ring = ring and len(bandKeys) > 0
+
+    # Second pass: the untouched triangles are written, the band triangles are kept for the clipper.
+    # The ring is the triangles sharing a vertex with the band
+    writer = StlWriter(outputPath)
+    try:
+        bandVertices = list()
+        numberOfBandTriangles = 0
+        for index, start in enumerate(chunks):
+            chunk = records[start:start + chunkSize]
+            vertices = chunk['vertices'].astype(numpy.float64)
+            removed, band = classifyTriangles(vertices, planes)
+            if ring:
+                band |= numpy.isin(vertexKeys(vertices), bandKeys).reshape(-1, 3).any(axis=1) & ~removed
+            writer.writeRecords(chunk[~(removed | band)])
+            bandVertices.append(numpy.array(chunk['vertices'][band]))
+            numberOfBandTriangles += int(band.sum())
+            bandBytes = numberOfBandTriangles * BAND_BYTES_PER_TRIANGLE
+            if bandBytes > memoryLimit * (1 - CHUNK_SHARE):
+                raise MemoryError("The %d triangles near the planes need about %.1f MB to be clipped, more than the "
+                                  "memory limit of %.1f MB" % (numberOfBandTriangles, bandBytes / 1024.0 ** 2,
+                                                               memoryLimit / 1024.0 ** 2))
+            workingBytes = max(workingBytes, len(chunk) * CHUNK_BYTES_PER_TRIANGLE + len(bandKeys) * 8
+                               + numberOfBandTriangles * STL_RECORD.itemsize)
+            report(0.25 + 0.5 * (index + 1) / len(chunks))
+        del bandKeys
+        stats['bandTriangles'] = numberOfBandTriangles
+
+        # The band is clipped in memory and appended to the output
+        if numberOfBandTriangles:
+            vertices = numpy.concatenate(bandVertices)
+            del bandVertices
+            clipper = engine.createClipper(bandPolyData(vertices), planes,
+                                           lambda fraction: report(0.75 + 0.25 * fraction))
+            triangleFilter = vtk.vtkTriangleFilter()
+            triangleFilter.SetInputConnection(clipper.GetOutputPort())
+            triangleFilter.PassVertsOff()
+            triangleFilter.PassLinesOff()
+            triangleFilter.Update()
+            output = triangleFilter.GetOutput()
+            triangles = polydata.trianglesAsArray(output)
+            if triangles is not None:
+                writer.writeTriangles(polydata.pointsAsArray(output)[triangles])
+            workingBytes = max(workingBytes, numberOfBandTriangles * BAND_BYTES_PER_TRIANGLE)
+    except Exception:
+        writer.close()
+        os.remove(outputPath)
+        raise
+    writer.close()
+    del records
+    report(1.0)
+    stats['trianglesOut'] = writer.count
+    stats['workingBytes'] = workingBytes
+    stats['peakMemoryBytes'] = instrumentation.peakMemoryBytes()
+    return stats
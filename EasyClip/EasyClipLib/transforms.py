@@ -0,0 +1,75 @@
+import numpy
+import vtk
+
+#
+# Transforms of the models to clip
+#
+
+
+def matrixAsArray(matrix):
+    return numpy.array([[matrix.GetElement(row, column) for column in range(4)] for row in range(4)])
+
+
+def transformKey(transformNode):
+    # Changes when the transform node or one of its parents changes
+    if transformNode is None:
+        return None
+    if hasattr(transformNode, 'GetTransformToWorldMTime'):
+        return transformNode.GetID(), transformNode.GetTransformToWorldMTime()
+    return transformNode.GetID(), transformNode.GetMTime()
+
+
+def transformPlanes(planes, worldToLocal, localToWorld):
+    # All the origins and normals in one numpy step. The normals are transformed by the inverse
+    # transpose of worldToLocal, which keeps them normal to the planes if the transform has a scaling
+    if not planes:
+        return []
+    origins = numpy.array([plane[0][:3] for plane in planes], dtype=float)
+    normals = numpy.array([plane[1][:3] for plane in planes], dtype=float)
+    localOrigins = numpy.dot(origins, worldToLocal[:3, :3].T) + worldToLocal[:3, 3]
+    localNormals = numpy.dot(normals, localToWorld[:3, :3])
+    localNormals /= numpy.linalg.norm(localNormals, axis=1)[:, numpy.newaxis]
+    return [(origin.tolist(), normal.tolist()) for origin, normal in zip(localOrigins, localNormals)]
+
+
+class TransformCache(object):
+    # Transforms of the transform nodes computed once per node and MTime, shared by all the
+    # models under the same transform
+    def __init__(self):
+        # node ID -> (key, value)
+        self.linear = dict()
+        self.nonLinear = dict()
+
+    def cached(self, cache, transformNode, compute):
+        key = transformKey(transformNode)
+        entry = cache.get(transformNode.GetID())
+        if entry is None or entry[0] != key:
+            entry = (key, compute(transformNode))
+            cache[transformNode.GetID()] = entry
+        return entry[1]
+
+    def isLinear(self, transformNode):
+        return transformNode is None or transformNode.IsTransformToWorldLinear()
+
+    def getMatrices(self, transformNode):
+        # (world to local, local to world) 4x4 arrays of a linear transform
+        def compute(node):
+            matrix = vtk.vtkMatrix4x4()
+            node.GetMatrixTransformToWorld(matrix)
+            localToWorld = matrixAsArray(matrix)
+            return numpy.linalg.inv(localToWorld), localToWorld
+        return self.cached(self.linear, transformNode, compute)
+
+    def getGeneralTransforms(self, transformNode):
+        # (local to world, world to local) vtkGeneralTransform of a non-linear transform
+        def compute(node):
+            toWorld = vtk.vtkGeneralTransform()
+            node.GetTransformToWorld(toWorld)
+            fromWorld = vtk.vtkGeneralTransform()
+            node.GetTransformFromWorld(fromWorld)
+            return toWorld, fromWorld
+        return self.cached(self.nonLinear, transformNode, compute)
+
+    def clear(self):
+        self.linear = dict()
+        self.nonLinear = dict()
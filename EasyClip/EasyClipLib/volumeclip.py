@@ -0,0 +1,97 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# Clipping of voxel volumes (label maps, scalar volumes) with the clipping planes
+#
+# The volume array is indexed [k, j, i] as given by slicer.util.arrayFromVolume. The voxels on the
+# removed side of any plane are set to the background value, one slab of k slices at a time so that
+# the temporary arrays stay small. With a linear transform a plane distance is an affine function of
+# (i, j, k), evaluated by broadcasting; with a non-linear transform the voxel centers of the slab are
+# transformed to world coordinates.
+#
+
+# Voxels evaluated at once
+SLAB_VOXELS = 8 * 1024 * 1024
+
+
+def planeCoefficients(planes, ijkToPlanes):
+    # Distance to each plane as a * [i, j, k] + c, for planes given in the coordinates
+    # reached by the 4x4 ijkToPlanes matrix (RAS of the volume, or world)
+    normals = numpy.array([plane[1][:3] for plane in planes], dtype=float)
+    origins = numpy.array([plane[0][:3] for plane in planes], dtype=float)
+    a = numpy.dot(normals, ijkToPlanes[:3, :3])
+    c = numpy.einsum('ij,ij->i', normals, ijkToPlanes[:3, 3] - origins)
+    return a, c
+
+
+def slabKeptMask(a, c, kRange, dimensions):
+    # Boolean (len(kRange), J, I) mask of the voxels on the kept side of all the planes
+    numberOfI, numberOfJ = dimensions[0], dimensions[1]
+    i = numpy.arange(numberOfI, dtype=float)[numpy.newaxis, numpy.newaxis, :]
+    j = numpy.arange(numberOfJ, dtype=float)[numpy.newaxis, :, numpy.newaxis]
+    k = numpy.asarray(kRange, dtype=float)[:, numpy.newaxis, numpy.newaxis]
+    mask = numpy.ones((len(kRange), numberOfJ, numberOfI), dtype=bool)
+    for (ai, aj, ak), constant in zip(a, c):
+        mask &= (ai * i + aj * j + ak * k + constant) >= 0
+    return mask
+
+
+def slabKeptMaskTransformed(planes, kRange, dimensions, ijkToLocal, toWorld):
+    # Same mask for a volume under a non-linear transform: the voxel centers go through toWorld
+    numberOfI, numberOfJ = dimensions[0], dimensions[1]
+    k, j, i = numpy.meshgrid(numpy.asarray(kRange, dtype=float), numpy.arange(numberOfJ, dtype=float),
+                             numpy.arange(numberOfI, dtype=float), indexing='ij')
+    ijk = numpy.stack([i.ravel(), j.ravel(), k.ravel()], axis=1)
+    local = numpy.dot(ijk, ijkToLocal[:3, :3].T) + ijkToLocal[:3, 3]
+    localPoints = vtk.vtkPoints()
+    localPoints.SetData(numpy_support.numpy_to_vtk(local, deep=1))
+    worldPoints = vtk.vtkPoints()
+    toWorld.TransformPoints(localPoints, worldPoints)
+    world = numpy_support.vtk_to_numpy(worldPoints.GetData())
+    mask = numpy.ones(len(world), dtype=bool)
+    for origin, normal in planes:
+        mask &= numpy.dot(world - numpy.asarray(origin[:3], dtype=float), numpy.asarray(normal[:3], dtype=float)) >= 0
+    return mask.reshape(len(kRange), numberOfJ, numberOfI)
+
+
+def clipVolumeArray(array, ijkToLocal, planes, background=0, toWorld=None, slabVoxels=SLAB_VOXELS):
+    # Sets the removed voxels of array (modified in place) to background.
+    # planes: in the coordinates of ijkToLocal, or in world coordinates if toWorld (vtkAbstractTransform
+    # from the local coordinates to the world) is given.
+    # Returns the [k, j, i] index ranges ((kmin, kmax), (jmin, jmax), (imin, imax)) of the voxels that are
+    # kept and not background, or None if there is none
+    numberOfK, numberOfJ, numberOfI = array.shape[:3]
+    dimensions = (numberOfI, numberOfJ, numberOfK)
+    if toWorld is None:
+        a, c = planeCoefficients(planes, ijkToLocal)
+    slabSize = max(1, slabVoxels // max(1, numberOfI * numberOfJ))
+    keptK = numpy.zeros(numberOfK, dtype=bool)
+    keptJ = numpy.zeros(numberOfJ, dtype=bool)
+    keptI = numpy.zeros(numberOfI, dtype=bool)
+    for start in range(0, numberOfK, slabSize):
+        kRange = range(start, min(start + slabSize, numberOfK))
+        if toWorld is None:
+            mask = slabKeptMask(a, c, kRange, dimensions)
+        else:
+            mask = slabKeptMaskTransformed(planes, kRange, dimensions, ijkToLocal, toWorld)
+        slab = array[kRange.start:kRange.stop]
+        slab[~mask] = background
+        filled = slab != background
+        if filled.ndim == 4:
+            # Vector volume: a voxel is filled if any component is
+            filled = filled.any(axis=3)
+        keptK[kRange.start:kRange.stop] = filled.any(axis=(1, 2))
+        keptJ |= filled.any(axis=(0, 2))
+        keptI |= filled.any(axis=(0, 1))
+    if not keptK.any():
+        return None
+    return tuple((int(numpy.argmax(kept)), int(len(kept) - 1 - numpy.argmax(kept[::-1])))
+                 for kept in (keptK, keptJ, keptI))
+
+
+def cropArray(array, extent):
+    # extent as returned by clipVolumeArray. Returns the cropped copy and the (i, j, k) index of its first voxel
+    (k0, k1), (j0, j1), (i0, i1) = extent
+    return array[k0:k1 + 1, j0:j1 + 1, i0:i1 + 1].copy(), (i0, j0, k0)
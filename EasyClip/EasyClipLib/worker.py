@@ -0,0 +1,67 @@
+import threading
+
+from . import engine
+
+#
+# Clipping in a background thread
+#
+# Only the vtk work runs in the thread: the caller prepares the jobs and applies the
+# results on the main thread, after polling isRunning() (e.g. from a QTimer).
+#
+
+
+class BackgroundClipping(object):
+    def __init__(self, jobs, options=None, maxWorkers=1, cache=None, compaction=None, clipRun=None):
+        self.jobs = jobs
+        # instrumentation.ClipRun of the clipping, finished by the caller once the results are applied
+        self.clipRun = clipRun
+        self.options = options or {}
+        self.maxWorkers = maxWorkers
+        self.cache = cache
+        self.compaction = compaction
+        self.abortEvent = threading.Event()
+        # Written by the worker threads, read by the main thread
+        self.currentJobIndex = 0
+        self.jobProgress = [0.0] * len(jobs)
+        self.completed = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="EasyClipClipping")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.completed = engine.clipJobs(self.jobs, self.options, self.onProgress, self.abortEvent,
+                                             self.maxWorkers, self.cache, self.compaction)
+        except Exception as e:
+            self.error = e
+
+    def onProgress(self, jobIndex, fraction):
+        self.currentJobIndex = jobIndex
+        self.jobProgress[jobIndex] = fraction
+
+    def cancel(self):
+        self.abortEvent.set()
+
+    def isCancelled(self):
+        return self.abortEvent.is_set()
+
+    def isRunning(self):
+        return self.thread.is_alive()
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+
+    @property
+    def progress(self):
+        # Overall fraction of the jobs done
+        if not self.jobs:
+            return 1.0
+        return min(1.0, sum(self.jobProgress) / len(self.jobs))
+
+    def currentJobName(self):
+        if not self.jobs:
+            return ""
+        return self.jobs[min(self.currentJobIndex, len(self.jobs) - 1)].name
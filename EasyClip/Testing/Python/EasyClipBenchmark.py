@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+#
+# Offline benchmark of the EasyClip logic
+#
+# Usage, with a python providing vtk and numpy (e.g. Slicer's PythonSlicer):
+#   python EasyClipBenchmark.py --output benchmark.json
+#   python EasyClipBenchmark.py --sizes 20000 200000 --baseline benchmark.json
+#
+# Each case clips synthetic closed meshes (spheres, tori, tooth-like shapes) with two slice planes,
+# through EasyClipLogic.clipping() on a stand-in of the Slicer scene (mockslicer), and computes the
+# box around the models as onComputeBox() does. Every case runs in its own process so that its peak
+# memory is measured alone. With --baseline, the cases slower than the baseline report by more than
+# --tolerance are listed and the exit code is 1.
+#
+
+TESTING_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MODULE_DIRECTORY = os.path.dirname(os.path.dirname(TESTING_DIRECTORY))
+
+SHAPES = ('sphere', 'torus', 'tooth')
+SIZES = (20000, 200000, 1000000)
+
+
+def benchmarkCases(shapes, sizes):
+    cases = list()
+    for shape in shapes:
+        for triangles in sizes:
+            for bandLimited in (False, True):
+                cases.append({'shape': shape, 'triangles': triangles, 'models': 1, 'bandLimited': bandLimited,
+                              'transformed': False})
+    # Several models clipped together, and a model under a linear transform
+    for triangles in sizes:
+        cases.append({'shape': 'tooth', 'triangles': triangles, 'models': 4, 'bandLimited': False,
+                      'transformed': False})
+        cases.append({'shape': 'tooth', 'triangles': triangles, 'models': 1, 'bandLimited': False,
+                      'transformed': True})
+    for case in cases:
+        case['name'] = "%s_%d%s%s%s" % (case['shape'], case['triangles'],
+                                        "_x%d" % case['models'] if case['models'] > 1 else "",
+                                        "_band" if case['bandLimited'] else "",
+                                        "_transformed" if case['transformed'] else "")
+    return cases
+
+
+def peakMemoryBytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def runCase(case, repeat, threads):
+    # Runs in the case process
+    sys.path.insert(0, MODULE_DIRECTORY)
+    sys.path.insert(0, TESTING_DIRECTORY)
+    import mockslicer
+    slicer = mockslicer.install()
+    import vtk
+    import EasyClip
+    import syntheticmeshes
+
+    scene = slicer.mrmlScene
+    logic = EasyClip.EasyClipLogic(None)
+    logic.bandLimitedClipping = case['bandLimited']
+    if threads:
+        logic.clippingThreads = threads
+
+    transformNode = None
+    if case['transformed']:
+        transform = vtk.vtkTransform()
+        transform.Translate(5.0, -3.0, 2.0)
+        transform.RotateWXYZ(30.0, 1.0, 1.0, 0.0)
+        transformNode = scene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'Transform')
+        transformNode.SetMatrixTransformToParent(transform.GetMatrix())
+    meshes = list()
+    models = list()
+    for index in range(case['models']):
+        mesh = syntheticmeshes.generate(case['shape'], case['triangles'])
+        model = scene.AddNewNodeByClass('vtkMRMLModelNode', "%s_%d" % (case['shape'], index))
+        model.CreateDefaultDisplayNodes()
+        model.SetAndObservePolyData(mesh)
+        if transformNode is not None:
+            model.SetAndObserveTransformNodeID(transformNode.GetID())
+        meshes.append(mesh)
+        models.append(model)
+
+    # Red plane above the center keeping the top, Green plane behind it keeping the front
+    size = syntheticmeshes.SIZE
+    slicer.util.getNode('vtkMRMLSliceNodeRed').GetSliceToRAS().SetElement(2, 3, size * 0.15)
+    slicer.util.getNode('vtkMRMLSliceNodeGreen').GetSliceToRAS().SetElement(1, 3, -size * 0.1)
+    for sliceNodeID in ('vtkMRMLSliceNodeRed', 'vtkMRMLSliceNodeGreen'):
+        planeDef = logic.planeDict[sliceNodeID]
+        planeDef.boxState = True
+        planeDef.posState = True
+        planeDef.negState = False
+    logic.getCoord()
+
+    baselineMemory = peakMemoryBytes()
+    clipTimes = list()
+    boxTimes = list()
+    cachedBoxTimes = list()
+    for _ in range(repeat):
+        for model, mesh in zip(models, meshes):
+            model.SetAndObservePolyData(mesh)
+        logic.history.clear()
+        logic.boundsCache.clear()
+        start = time.perf_counter()
+        logic.getWorldBoundsOfModels(logic.getVisibleModels())
+        boxTimes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        logic.getWorldBoundsOfModels(logic.getVisibleModels())
+        cachedBoxTimes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        logic.clipping()
+        clipTimes.append(time.perf_counter() - start)
+
+    trianglesIn = sum(mesh.GetNumberOfPolys() for mesh in meshes)
+    trianglesOut = sum(model.GetPolyData().GetNumberOfPolys() for model in models)
+    clipSeconds = statistics.median(clipTimes)
+    peakMemory = peakMemoryBytes()
+    result = dict(case)
+    result.update({
+        'trianglesIn': trianglesIn,
+        'trianglesOut': trianglesOut,
+        'repeat': repeat,
+        'clipSeconds': clipSeconds,
+        'clipSecondsMin': min(clipTimes),
+        'trianglesPerSecond': trianglesIn / clipSeconds if clipSeconds > 0 else None,
+        'computeBoxSeconds': statistics.median(boxTimes),
+        'computeBoxCachedSeconds': statistics.median(cachedBoxTimes),
+        'baselineMemoryBytes': baselineMemory,
+        'peakMemoryBytes': peakMemory,
+        'clipMemoryBytes': max(0, peakMemory - baselineMemory),
+        'undoBytes': logic.history.nbytes,
+        'stages': logic.profiler.lastRun().summary()['stages'],
+    })
+    logic.cleanup()
+    return result
+
+
+def runCaseProcess(case, repeat, threads):
+    command = [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case), '--repeat', str(repeat)]
+    if threads:
+        command += ['--threads', str(threads)]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        result = dict(case)
+        result['error'] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"
+        return result
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def machineDescription():
+    import vtk
+    return {'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpuCount': os.cpu_count(),
+            'python': platform.python_version(),
+            'vtk': vtk.vtkVersion.GetVTKVersion()}
+
+
+def compareReports(report, baseline, tolerance):
+    # Cases slower than in the baseline by more than tolerance (0.25: 25%)
+    baselineCases = dict((case['name'], case) for case in baseline.get('cases', []) if 'error' not in case)
+    regressions = list()
+    for case in report['cases']:
+        reference = baselineCases.get(case['name'])
+        if reference is None or 'error' in case:
+            continue
+        for metric in ('clipSeconds', 'computeBoxSeconds'):
+            if reference[metric] > 0 and case[metric] > reference[metric] * (1.0 + tolerance):
+                regressions.append((case['name'], metric, reference[metric], case[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the EasyClip clipping on synthetic meshes, without Slicer.")
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES), help="triangles per mesh")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case, the median time is reported")
+    parser.add_argument('--threads', type=int, default=None, help="clipping threads (default: the logic default)")
+    parser.add_argument('--output', default='easyclip_benchmark.json', help="JSON report")
+    parser.add_argument('--baseline', default=None, help="previous JSON report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(runCase(json.loads(args.case), args.repeat, args.threads)))
+        return 0
+
+    report = {'machine': machineDescription(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'cases': list()}
+    for case in benchmarkCases(args.shapes, args.sizes):
+        result = runCaseProcess(case, args.repeat, args.threads)
+        report['cases'].append(result)
+        if 'error' in result:
+            print("%-32s failed: %s" % (case['name'], result['error']))
+        else:
+            print("%-32s clip %8.3fs %10.0f tri/s  box %7.4fs  peak %7.1f MB" % (
+                case['name'], result['clipSeconds'], result['trianglesPerSecond'] or 0,
+                result['computeBoxSeconds'], result['peakMemoryBytes'] / 1024.0 ** 2))
+    with open(args.output, 'w') as reportFile:
+        json.dump(report, reportFile, indent=2)
+
+    failed = [case for case in report['cases'] if 'error' in case]
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compareReports(report, json.load(baselineFile), args.tolerance)
+        for name, metric, before, after in regressions:
+            print("Regression: %s %s %.4fs -> %.4fs" % (name, metric, before, after))
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
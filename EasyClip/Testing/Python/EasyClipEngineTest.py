@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+
+#
+# Tests of the clipping engine on closed synthetic meshes, without Slicer
+#
+# Usage, with a python providing vtk and numpy (e.g. Slicer's PythonSlicer):
+#   python EasyClipEngineTest.py
+#
+
+TESTING_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MODULE_DIRECTORY = os.path.dirname(os.path.dirname(TESTING_DIRECTORY))
+sys.path.insert(0, MODULE_DIRECTORY)
+sys.path.insert(0, TESTING_DIRECTORY)
+
+import numpy
+import vtk
+
+import syntheticmeshes
+from EasyClipLib import engine
+from EasyClipLib import history
+from EasyClipLib import polydata
+
+# Planes crossing the meshes, each keeping the side its normal points to
+PLANES = [[((0.0, 0.0, 0.0), (0.0, 0.0, 1.0))],
+          [((1.3, -0.7, 2.1), (0.3, 0.8, -0.5))],
+          [((0.0, 0.0, 0.0), (0.0, 0.0, 1.0)), ((2.0, 0.0, 0.0), (-1.0, 0.2, 0.1))]]
+
+
+def openEdges(polyData):
+    # Number of boundary and non-manifold edges: 0 for a closed surface
+    edges = vtk.vtkFeatureEdges()
+    edges.SetInputData(polyData)
+    edges.BoundaryEdgesOn()
+    edges.NonManifoldEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.Update()
+    return edges.GetOutput().GetNumberOfCells()
+
+
+def massProperties(polyData):
+    properties = vtk.vtkMassProperties()
+    properties.SetInputData(polyData)
+    properties.Update()
+    return properties.GetVolume(), properties.GetSurfaceArea()
+
+
+class EngineTest(unittest.TestCase):
+    def meshes(self):
+        for shape in ('sphere', 'torus', 'tooth'):
+            yield shape, syntheticmeshes.generate(shape, 5000)
+
+    def test_bandClippingMatchesFullClipping(self):
+        for shape, mesh in self.meshes():
+            for planes in PLANES:
+                with self.subTest(shape=shape, planes=planes):
+                    full = engine.clipPolyData(mesh, planes)
+                    band = engine.clipPolyData(mesh, planes, bandLimited=True)
+                    # The caps may be triangulated differently: only the surfaces are compared
+                    self.assertEqual(openEdges(band), 0)
+                    self.assertEqual(openEdges(full), 0)
+                    for bandValue, fullValue in zip(massProperties(band), massProperties(full)):
+                        self.assertAlmostEqual(bandValue, fullValue, delta=1e-6 * fullValue)
+
+    def test_splitHalvesAreClosed(self):
+        for shape, mesh in self.meshes():
+            for planes in PLANES:
+                with self.subTest(shape=shape, planes=planes):
+                    kept, removed = engine.splitPolyData(mesh, planes)
+                    self.assertGreater(kept.GetNumberOfCells(), 0)
+                    self.assertGreater(removed.GetNumberOfCells(), 0)
+                    self.assertEqual(openEdges(kept), 0)
+                    # With several planes the removed part is made of closed pieces that share no point
+                    self.assertEqual(openEdges(removed), 0)
+
+    def test_snapshotRoundTrip(self):
+        for shape, mesh in self.meshes():
+            clipped = engine.clipPolyData(mesh, PLANES[0])
+            points = polydata.pointsAsArray(clipped)
+            triangles = polydata.trianglesAsArray(clipped)
+            with self.subTest(shape=shape, quantizationBits=None):
+                restored = history.PolyDataSnapshot(clipped).restore()
+                numpy.testing.assert_array_equal(polydata.pointsAsArray(restored), points)
+                numpy.testing.assert_array_equal(polydata.trianglesAsArray(restored), triangles)
+                self.assertEqual(restored.GetCellData().GetNumberOfArrays(), clipped.GetCellData().GetNumberOfArrays())
+            with self.subTest(shape=shape, quantizationBits=16):
+                restored = history.PolyDataSnapshot(clipped, quantizationBits=16).restore()
+                # Half a quantization step over the bounding box at most
+                extent = points.max(axis=0) - points.min(axis=0)
+                error = numpy.abs(polydata.pointsAsArray(restored) - points)
+                self.assertTrue((error <= extent / (2 ** 16 - 1) / 2 + 1e-9).all())
+                numpy.testing.assert_array_equal(polydata.trianglesAsArray(restored), triangles)
+
+
+if __name__ == '__main__':
+    unittest.main()
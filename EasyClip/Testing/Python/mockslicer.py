@@ -0,0 +1,437 @@
+import sys
+import types
+
+import vtk
+
+#
+# Stand-in for the parts of Slicer used by the EasyClip logic, to run it in a plain python with vtk
+#
+# install() puts vtk, qt, ctk and slicer in __main__ (EasyClip.py imports them from there) and a
+# slicer module in sys.modules, with a scene holding the nodes of a default Slicer scene: the three
+# slice nodes and their slice models. Only the methods called by EasyClip are implemented, the
+# nodes are python objects except their polydata and matrices, which are real vtk objects.
+#
+
+_nextMTime = [1]
+
+
+def newMTime():
+    _nextMTime[0] += 1
+    return _nextMTime[0]
+
+
+class MRMLNodeNotFoundException(Exception):
+    pass
+
+
+class MockObject(object):
+    # vtkObject observers: callback(caller, event) or, for the callbacks decorated with
+    # vtk.calldata_type, callback(caller, event, callData)
+    def __init__(self):
+        self.observers = dict()
+        self.nextObserverTag = 1
+        self.mtime = newMTime()
+
+    def AddObserver(self, event, callback, priority=0.0):
+        tag = self.nextObserverTag
+        self.nextObserverTag += 1
+        self.observers[tag] = (event, callback)
+        return tag
+
+    def RemoveObserver(self, tag):
+        self.observers.pop(tag, None)
+
+    def InvokeEvent(self, event, callData=None):
+        for tag, (observedEvent, callback) in list(self.observers.items()):
+            if observedEvent != event or tag not in self.observers:
+                continue
+            if hasattr(callback, 'CallDataType'):
+                callback(self, event, callData)
+            else:
+                callback(self, event)
+
+    def GetMTime(self):
+        return self.mtime
+
+    def Modified(self):
+        self.mtime = newMTime()
+        self.InvokeEvent(vtk.vtkCommand.ModifiedEvent)
+
+    def UnRegister(self, other):
+        pass
+
+
+class MockNode(MockObject):
+    classNames = ('vtkMRMLNode',)
+
+    def __init__(self):
+        MockObject.__init__(self)
+        self.scene = None
+        self.id = None
+        self.name = ''
+        self.attributes = dict()
+        self.hideFromEditors = False
+        self.saveWithScene = True
+
+    def GetClassName(self):
+        return self.classNames[0]
+
+    def IsA(self, className):
+        return className in self.classNames
+
+    def GetID(self):
+        return self.id
+
+    def GetName(self):
+        return self.name
+
+    def SetName(self, name):
+        self.name = name
+        self.Modified()
+
+    def GetAttribute(self, name):
+        return self.attributes.get(name)
+
+    def SetAttribute(self, name, value):
+        self.attributes[name] = value
+        self.Modified()
+
+    def GetAttributeNames(self):
+        return list(self.attributes)
+
+    def GetHideFromEditors(self):
+        return self.hideFromEditors
+
+    def SetHideFromEditors(self, hide):
+        self.hideFromEditors = bool(hide)
+
+    def HideFromEditorsOn(self):
+        self.SetHideFromEditors(True)
+
+    def SetSaveWithScene(self, save):
+        self.saveWithScene = bool(save)
+
+
+class MockDisplayNode(MockNode):
+    classNames = ('vtkMRMLModelDisplayNode', 'vtkMRMLDisplayNode', 'vtkMRMLNode')
+
+    def __init__(self):
+        MockNode.__init__(self)
+        self.visibility = True
+        self.color = (1.0, 1.0, 1.0)
+
+    def GetVisibility(self):
+        return self.visibility
+
+    def SetVisibility(self, visibility):
+        self.visibility = bool(visibility)
+        self.Modified()
+
+    def GetColor(self):
+        return self.color
+
+    def SetColor(self, *color):
+        self.color = tuple(color[0]) if len(color) == 1 else tuple(color)
+
+
+class MockTransformableNode(MockNode):
+    TransformModifiedEvent = 15000
+
+    def __init__(self):
+        MockNode.__init__(self)
+        self.transformNodeID = None
+
+    def GetTransformNodeID(self):
+        return self.transformNodeID
+
+    def SetAndObserveTransformNodeID(self, transformNodeID):
+        self.transformNodeID = transformNodeID
+        self.Modified()
+        self.InvokeEvent(self.TransformModifiedEvent)
+
+    def GetParentTransformNode(self):
+        if self.transformNodeID is None or self.scene is None:
+            return None
+        return self.scene.GetNodeByID(self.transformNodeID)
+
+
+class MockModelNode(MockTransformableNode):
+    classNames = ('vtkMRMLModelNode', 'vtkMRMLDisplayableNode', 'vtkMRMLTransformableNode', 'vtkMRMLNode')
+    DisplayModifiedEvent = 17000
+
+    def __init__(self):
+        MockTransformableNode.__init__(self)
+        self.polyData = None
+        self.displayNode = None
+
+    def GetPolyData(self):
+        return self.polyData
+
+    def SetAndObservePolyData(self, polyData):
+        self.polyData = polyData
+        self.Modified()
+
+    def CreateDefaultDisplayNodes(self):
+        if self.displayNode is None:
+            self.displayNode = MockDisplayNode()
+            if self.scene is not None:
+                self.scene.AddNode(self.displayNode)
+            self.InvokeEvent(self.DisplayModifiedEvent, self.displayNode)
+
+    def GetDisplayNode(self):
+        return self.displayNode
+
+    def GetDisplayVisibility(self):
+        return 1 if self.displayNode is not None and self.displayNode.GetVisibility() else 0
+
+    def SetDisplayVisibility(self, visibility):
+        if self.displayNode is not None:
+            self.displayNode.SetVisibility(visibility)
+            self.InvokeEvent(self.DisplayModifiedEvent, self.displayNode)
+
+
+class MockLinearTransformNode(MockTransformableNode):
+    classNames = ('vtkMRMLLinearTransformNode', 'vtkMRMLTransformNode', 'vtkMRMLTransformableNode', 'vtkMRMLNode')
+
+    def __init__(self):
+        MockTransformableNode.__init__(self)
+        self.matrixToParent = vtk.vtkMatrix4x4()
+
+    def SetMatrixTransformToParent(self, matrix):
+        self.matrixToParent.DeepCopy(matrix)
+        self.Modified()
+
+    def GetMatrixTransformToParent(self, matrix):
+        matrix.DeepCopy(self.matrixToParent)
+
+    def GetMatrixTransformToWorld(self, matrix):
+        matrix.DeepCopy(self.matrixToParent)
+        parent = self.GetParentTransformNode()
+        if parent is not None:
+            parentMatrix = vtk.vtkMatrix4x4()
+            parent.GetMatrixTransformToWorld(parentMatrix)
+            vtk.vtkMatrix4x4.Multiply4x4(parentMatrix, self.matrixToParent, matrix)
+
+    def GetTransformToWorldMTime(self):
+        parent = self.GetParentTransformNode()
+        return max(self.GetMTime(), parent.GetTransformToWorldMTime() if parent is not None else 0)
+
+    def IsTransformToWorldLinear(self):
+        return True
+
+
+class MockSliceNode(MockNode):
+    classNames = ('vtkMRMLSliceNode', 'vtkMRMLAbstractViewNode', 'vtkMRMLNode')
+
+    def __init__(self):
+        MockNode.__init__(self)
+        self.sliceToRAS = vtk.vtkMatrix4x4()
+        self.widgetVisible = False
+
+    def GetSliceToRAS(self):
+        return self.sliceToRAS
+
+    def UpdateMatrices(self):
+        self.Modified()
+
+    def SetWidgetVisible(self, visible):
+        self.widgetVisible = bool(visible)
+
+
+class MockMarkupsFiducialNode(MockTransformableNode):
+    classNames = ('vtkMRMLMarkupsFiducialNode', 'vtkMRMLMarkupsNode', 'vtkMRMLTransformableNode', 'vtkMRMLNode')
+
+    def __init__(self):
+        MockTransformableNode.__init__(self)
+        # (ID, label, position)
+        self.markups = list()
+
+    def AddFiducial(self, x, y, z, label=''):
+        self.markups.append(("%s_%d" % (self.id, len(self.markups)), label, (x, y, z)))
+        self.Modified()
+        return len(self.markups) - 1
+
+    def GetNumberOfMarkups(self):
+        return len(self.markups)
+
+    def GetNthMarkupID(self, n):
+        return self.markups[n][0]
+
+    def GetNthMarkupLabel(self, n):
+        return self.markups[n][1]
+
+    def GetNthFiducialPosition(self, n, position):
+        position[:] = self.markups[n][2]
+
+
+NODE_CLASSES = dict((nodeClass.classNames[0], nodeClass) for nodeClass in (
+    MockDisplayNode, MockModelNode, MockLinearTransformNode, MockSliceNode, MockMarkupsFiducialNode))
+
+
+class MockCollection(object):
+    def __init__(self, items):
+        self.items = list(items)
+
+    def GetNumberOfItems(self):
+        return len(self.items)
+
+    def GetItemAsObject(self, index):
+        return self.items[index]
+
+
+class MockScene(MockObject):
+    NodeAddedEvent = 66000
+    NodeRemovedEvent = 66001
+    NewSceneEvent = 66002
+    StartCloseEvent = 66004
+    EndCloseEvent = 66005
+    StartImportEvent = 66008
+    EndImportEvent = 66009
+    StartBatchProcessEvent = 66012
+    EndBatchProcessEvent = 66013
+
+    def __init__(self):
+        MockObject.__init__(self)
+        # Nodes in the order they were added, as GetNthNodeByClass iterates them
+        self.nodes = list()
+        self.nodesByID = dict()
+        self.idCounters = dict()
+        self.createDefaultNodes()
+
+    def createDefaultNodes(self):
+        # What the views of a default Slicer scene add: three slice nodes and their slice models
+        for color, orientation in (('Red', (0, 1, 2)), ('Yellow', (1, 2, 0)), ('Green', (0, 2, 1))):
+            sliceNode = MockSliceNode()
+            sliceNode.name = color
+            matrix = sliceNode.GetSliceToRAS()
+            matrix.Zero()
+            for column, axis in enumerate(orientation):
+                matrix.SetElement(axis, column, 1.0)
+            matrix.SetElement(3, 3, 1.0)
+            self.AddNode(sliceNode, 'vtkMRMLSliceNode' + color)
+            sliceModel = MockModelNode()
+            sliceModel.name = color + ' Volume Slice'
+            sliceModel.hideFromEditors = True
+            self.AddNode(sliceModel)
+            sliceModel.CreateDefaultDisplayNodes()
+            sliceModel.SetDisplayVisibility(False)
+
+    def AddNode(self, node, nodeID=None):
+        if nodeID is None:
+            className = node.GetClassName()
+            self.idCounters[className] = self.idCounters.get(className, 0) + 1
+            nodeID = className + str(self.idCounters[className])
+        node.id = nodeID
+        node.scene = self
+        self.nodes.append(node)
+        self.nodesByID[nodeID] = node
+        self.InvokeEvent(self.NodeAddedEvent, node)
+        return node
+
+    def AddNewNodeByClass(self, className, name=''):
+        node = self.CreateNodeByClass(className)
+        node.name = name
+        return self.AddNode(node)
+
+    def CreateNodeByClass(self, className):
+        return NODE_CLASSES[className]()
+
+    def RemoveNode(self, node):
+        if node.GetID() not in self.nodesByID:
+            return
+        self.nodes.remove(node)
+        del self.nodesByID[node.GetID()]
+        self.InvokeEvent(self.NodeRemovedEvent, node)
+        node.scene = None
+
+    def GetNodeByID(self, nodeID):
+        return self.nodesByID.get(nodeID)
+
+    def GetNodesByClass(self, className):
+        return MockCollection(node for node in self.nodes if node.IsA(className))
+
+    def GetNumberOfNodesByClass(self, className):
+        return sum(1 for node in self.nodes if node.IsA(className))
+
+    def GetNthNodeByClass(self, n, className):
+        nodes = [node for node in self.nodes if node.IsA(className)]
+        return nodes[n] if 0 <= n < len(nodes) else None
+
+    def GenerateUniqueName(self, baseName):
+        name = baseName
+        index = 0
+        while self.GetFirstNodeByName(name) is not None:
+            index += 1
+            name = "%s_%d" % (baseName, index)
+        return name
+
+    def GetFirstNodeByName(self, name):
+        for node in self.nodes:
+            if node.GetName() == name:
+                return node
+        return None
+
+    def Clear(self, removeSingletons=0):
+        self.InvokeEvent(self.StartCloseEvent)
+        for node in list(reversed(self.nodes)):
+            if not node.IsA('vtkMRMLSliceNode') and not node.GetName().endswith(' Volume Slice'):
+                self.RemoveNode(node)
+        self.InvokeEvent(self.EndCloseEvent)
+
+
+class MockScriptedLoadableModule(object):
+    def __init__(self, parent):
+        self.parent = parent
+
+
+class MockScriptedLoadableModuleWidget(object):
+    def __init__(self, parent=None):
+        self.parent = parent
+
+    def setup(self):
+        pass
+
+
+class MockScriptedLoadableModuleLogic(object):
+    def __init__(self, parent=None):
+        pass
+
+
+class MockScriptedLoadableModuleTest(object):
+    def delayDisplay(self, message, msec=0):
+        print(message)
+
+
+def install():
+    # Returns the slicer stand-in module, also published in __main__ and sys.modules
+    scene = MockScene()
+
+    def getNode(pattern):
+        node = scene.GetNodeByID(pattern) or scene.GetFirstNodeByName(pattern)
+        if node is None:
+            raise MRMLNodeNotFoundException("could not find nodes in the scene by name or id '%s'" % pattern)
+        return node
+
+    slicer = types.ModuleType('slicer')
+    slicer.mrmlScene = scene
+    slicer.util = types.SimpleNamespace(getNode=getNode, MRMLNodeNotFoundException=MRMLNodeNotFoundException)
+    slicer.app = types.SimpleNamespace(applicationPid=lambda: 0, temporaryPath='.')
+    slicer.modules = types.SimpleNamespace()
+    slicer.sys = sys
+    scriptedLoadableModule = types.ModuleType('slicer.ScriptedLoadableModule')
+    scriptedLoadableModule.ScriptedLoadableModule = MockScriptedLoadableModule
+    scriptedLoadableModule.ScriptedLoadableModuleWidget = MockScriptedLoadableModuleWidget
+    scriptedLoadableModule.ScriptedLoadableModuleLogic = MockScriptedLoadableModuleLogic
+    scriptedLoadableModule.ScriptedLoadableModuleTest = MockScriptedLoadableModuleTest
+    scriptedLoadableModule.__all__ = ['ScriptedLoadableModule', 'ScriptedLoadableModuleWidget',
+                                      'ScriptedLoadableModuleLogic', 'ScriptedLoadableModuleTest']
+    slicer.ScriptedLoadableModule = scriptedLoadableModule
+    sys.modules['slicer'] = slicer
+    sys.modules['slicer.ScriptedLoadableModule'] = scriptedLoadableModule
+
+    main = sys.modules['__main__']
+    main.vtk = vtk
+    main.qt = types.ModuleType('qt')
+    main.ctk = types.ModuleType('ctk')
+    main.slicer = slicer
+    return slicer
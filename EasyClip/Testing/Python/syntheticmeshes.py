@@ -0,0 +1,80 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from EasyClipLib import polydata
+
+#
+# Closed triangle meshes generated at any resolution, standing in for the scans clipped with EasyClip
+#
+# The shapes are centered on the origin with a size of about 20 mm, as a tooth or a small bone.
+#
+
+SIZE = 20.0
+
+
+def sphere(resolution):
+    # About 2 * resolution**2 triangles
+    source = vtk.vtkSphereSource()
+    source.SetRadius(SIZE / 2)
+    source.SetThetaResolution(resolution)
+    source.SetPhiResolution(resolution)
+    source.Update()
+    mesh = vtk.vtkPolyData()
+    mesh.ShallowCopy(source.GetOutput())
+    return mesh
+
+
+def torus(resolution):
+    # 2 * resolution**2 triangles. Built on a periodic grid, so the seams share their points
+    # and the surface is closed, which is not the case of vtkParametricTorus
+    ringRadius = SIZE / 3
+    tubeRadius = SIZE / 6
+    u, v = numpy.meshgrid(numpy.linspace(0, 2 * numpy.pi, resolution, endpoint=False),
+                          numpy.linspace(0, 2 * numpy.pi, resolution, endpoint=False), indexing='ij')
+    points = numpy.stack([(ringRadius + tubeRadius * numpy.cos(v)) * numpy.cos(u),
+                          (ringRadius + tubeRadius * numpy.cos(v)) * numpy.sin(u),
+                          tubeRadius * numpy.sin(v)], axis=-1).reshape(-1, 3)
+    i, j = numpy.meshgrid(numpy.arange(resolution), numpy.arange(resolution), indexing='ij')
+    a = (i * resolution + j).ravel()
+    b = (((i + 1) % resolution) * resolution + j).ravel()
+    c = (((i + 1) % resolution) * resolution + (j + 1) % resolution).ravel()
+    d = (i * resolution + (j + 1) % resolution).ravel()
+    triangles = numpy.concatenate([numpy.stack([a, b, c], axis=1), numpy.stack([a, c, d], axis=1)])
+    return polydata.polyDataFromArrays(points, triangles)
+
+
+def tooth(resolution):
+    # Sphere deformed into a crown with four cusps over a tapered root, about 2 * resolution**2
+    # triangles. Each deformation maps space onto itself, so the surface stays closed and
+    # does not intersect itself
+    mesh = sphere(resolution)
+    points = polydata.pointsAsArray(mesh).astype(float) / (SIZE / 2)
+    radius = numpy.linalg.norm(points, axis=1)
+    elevation = points[:, 2] / radius
+    azimuth = numpy.arctan2(points[:, 1], points[:, 0])
+    # Cusps on the occlusal side
+    cusps = 1.0 + 0.12 * numpy.clip(elevation, 0, None) ** 2 * numpy.cos(4 * azimuth)
+    points *= cusps[:, numpy.newaxis]
+    # Root: longer and narrower towards the apex
+    root = points[:, 2] < 0
+    taper = 1.0 + 0.45 * points[root, 2]
+    points[root, 0] *= taper
+    points[root, 1] *= taper
+    points[root, 2] *= 1.8
+    points *= SIZE / 2
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(numpy.ascontiguousarray(points), deep=1))
+    deformed = vtk.vtkPolyData()
+    deformed.SetPoints(vtkPoints)
+    deformed.SetPolys(mesh.GetPolys())
+    return deformed
+
+
+SHAPES = {'sphere': sphere, 'torus': torus, 'tooth': tooth}
+
+
+def generate(shape, triangles):
+    # Mesh of the shape with about the given number of triangles
+    resolution = max(8, int(round((triangles / 2.0) ** 0.5)))
+    return SHAPES[shape](resolution)